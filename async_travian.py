@@ -0,0 +1,382 @@
+import asyncio
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import aiohttp
+
+from travian import PRODUCIBLE_BUILDINGS, URLS, Parser, TokenBucket, hero_transfer_amounts, load_config
+
+
+class AsyncTravian(object):
+
+    def __init__(self, parse_workers=2, max_connections=100):
+        config_json = load_config()
+        self.username = config_json.get("username") or os.getenv("tr_username")
+        if not self.username:
+            logging.error("Login failed, username is not given.")
+            exit()
+        self.password = config_json.get("password") or os.getenv("tr_password")
+        if not self.password:
+            logging.error("Login failed, password is not given.")
+            exit()
+        self.server = config_json.get("server") or os.getenv("tr_server")
+        if not self.server:
+            logging.error("Login failed, server is not given.")
+            exit()
+        self.base_url = self.server if "://" in self.server else f"https://{self.server}"
+        self.proxy = config_json.get("proxy") or None
+        self.parser = Parser(config_json.get("parser"))
+        self.mapping = self.parser.mapping
+        self.urls = dict(URLS)
+        self.producible_buildings = list(PRODUCIBLE_BUILDINGS)
+        self.parse_workers = parse_workers
+        self.executor = None
+        self.max_connections = max_connections
+        self.session = None
+        self.token = None
+        self.logged_in = False
+        self.login_lock = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        if self.session is None:
+            #  unsafe lets the cookie jar keep cookies of servers given by IP address
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections), cookie_jar=aiohttp.CookieJar(unsafe=True))
+            self.login_lock = asyncio.Lock()
+        if self.executor is None:
+            #  parsing is CPU bound, it runs here instead of blocking the event loop
+            self.executor = ThreadPoolExecutor(max_workers=self.parse_workers)
+        if not self.logged_in:
+            self.logged_in = await self.login()
+        return self.logged_in
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            #  the cookies went with the session, the next start logs in again
+            self.logged_in = False
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def parse(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def logged_out(self, response):
+        if response.status == 401:
+            return True
+        return bool(response.history) and urlparse(str(response.url)).path in ["/", "/login.php"]
+
+    async def request(self, method, path, json_response=False, auth=False, relogin=True, **kwargs):
+        if auth:
+            kwargs["headers"] = dict(kwargs.get("headers") or {}, Authorization=f"Bearer {self.token}")
+        token = self.token
+        async with self.session.request(method, f"{self.base_url}{path}", proxy=self.proxy, **kwargs) as response:
+            logged_out = self.logged_out(response)
+            if not (relogin and logged_out):
+                return await response.json(content_type=None) if json_response else await response.text()
+        async with self.login_lock:
+            if self.token == token:
+                logging.warning("Session is logged out, logging in again.")
+                self.logged_in = await self.login()
+        return await self.request(method, path, json_response=json_response, auth=auth, relogin=False, **kwargs)
+
+    async def login(self):
+        logging.debug("Start logging in.")
+        nonce_json = await self.request("POST", self.urls["login"], json_response=True, relogin=False, json={
+            "name": self.username,
+            "password": self.password,
+            "w": "1440:900",
+            "mobileOptimizations": False
+        })
+        nonce = nonce_json.get("nonce")
+        logging.debug(f"login nonce: {nonce}")
+        if nonce:
+            token_json = await self.request("POST", f"/api/v1/auth/{nonce}", json_response=True, relogin=False)
+            self.token = token_json.get("token")
+            logging.debug(f"login token: {self.token}")
+            test_login = await self.request("GET", self.urls["dorf1"], relogin=False)
+            if await self.parse(self.parser.parse_section, test_login, "player_name") == self.username:
+                logging.info(f"Login successfully, username: {self.username}")
+                return True
+            logging.error("Login failed, cannot get the username.")
+        else:
+            logging.error("Login failed, cannot get the nonce.")
+        return False
+
+    async def get_info(self, params=None):
+        logging.debug("Getting info from dorf1 and dorf2.")
+        dorf1_page, dorf2_page = await asyncio.gather(
+            self.request("GET", self.urls["dorf1"], params=params),
+            self.request("GET", self.urls["dorf2"], params=params)
+        )
+        info, dorf2_info = await asyncio.gather(
+            self.parse(self.parser.parse_dorf1, dorf1_page),
+            self.parse(self.parser.parse_dorf2, dorf2_page)
+        )
+        info.update(dorf2_info)
+        return info
+
+    async def get_all_villages_info(self, concurrency=4):
+        village_list = (await self.get_info())["village_list"]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(village):
+            async with semaphore:
+                return await self.get_info(params={"newdid": village["id"]})
+
+        infos = await asyncio.gather(*[fetch(_) for _ in village_list], return_exceptions=True)
+        current = [_["id"] for _ in village_list if _["current"]]
+        if current:
+            await self.request("GET", self.urls["dorf1"], params={"newdid": current[0]})
+        villages = []
+        for village, info in zip(village_list, infos):
+            if isinstance(info, Exception):
+                logging.error(f"Failed to get info of village {village['name']}: {info}")
+                info = None
+            villages.append({
+                "id": village["id"],
+                "name": village["name"],
+                "coordinates": village["coordinates"],
+                "info": info
+            })
+        return villages
+
+    async def get_hero_attributes(self):
+        logging.debug("Getting hero info.")
+        attributes_page = await self.request("GET", self.urls["hero_attributes"])
+        return await self.parse(self.parser.parse_hero_attributes, attributes_page)
+
+    async def get_hero_inventory(self):
+        logging.debug("Getting hero inventory.")
+        inventory_raw = await self.request("GET", self.urls["hero_inventory"], json_response=True, auth=True)
+        if not inventory_raw:
+            logging.error("Failed to get hero inventory JSON.")
+            return None
+        return self.parser.parse_hero_inventory(inventory_raw)
+
+    async def get_tile_info(self, x, y):
+        logging.debug(f"Getting tile info of ({x}, {y})")
+        tile_json = await self.request("POST", self.urls["tile"], json_response=True, auth=True, json={
+            "x": x,
+            "y": y
+        })
+        return await self.parse(self.parser.parse_tile, tile_json["html"])
+
+    async def scan_tiles(self, coordinates, concurrency=32, rate=5):
+        bucket = TokenBucket(rate)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(x, y):
+            async with semaphore:
+                await asyncio.sleep(bucket.reserve())
+                try:
+                    return (x, y), await self.get_tile_info(x, y)
+                except (aiohttp.ClientError, ValueError, KeyError) as e:
+                    logging.error(f"Failed to get tile info of ({x}, {y}): {e}")
+                    return (x, y), None
+
+        for future in asyncio.as_completed([fetch(x, y) for x, y in coordinates]):
+            yield await future
+
+    async def get_training_buildings(self, info=None):
+        info = info or await self.get_info()
+        current_producible_buildings = [_ for _ in info["buildings"] if _["building_id"] in self.producible_buildings]
+        if not current_producible_buildings:
+            logging.warning("No buildings can produce units.")
+            return []
+
+        async def fetch(cpb):
+            building_page = await self.request("GET", self.urls["build"], params={
+                "id": cpb["id"],
+                "gid": cpb["building_id"]
+            })
+            training = await self.parse(self.parser.parse_training, building_page, cpb["building_id"])
+            training.update({"slot_id": cpb["id"], "building_id": cpb["building_id"], "name": cpb["name"]})
+            return training
+
+        return await asyncio.gather(*[fetch(_) for _ in current_producible_buildings])
+
+    async def get_producible_units(self, info=None):
+        training_buildings = await self.get_training_buildings(info)
+        if not training_buildings:
+            return None
+        return [unit for tb in training_buildings for unit in tb["units"]]
+
+    async def produce_units(self, product_plan, info=None):
+        jobs = []
+        for tb in await self.get_training_buildings(info):
+            if not tb["form"]:
+                logging.warning(f"No training form in {tb['name']}(slot_id={tb['slot_id']}).")
+                continue
+            produce_unit_payload = dict(tb["form"])
+            for unit in tb["units"]:
+                produce_unit_payload[unit["troop_type"]] = min(int(product_plan.get(unit["troop_type"], 0)), unit["max_production"])
+            if any(produce_unit_payload.get(unit["troop_type"]) for unit in tb["units"]):
+                jobs.append((tb, produce_unit_payload))
+
+        async def submit(tb, produce_unit_payload):
+            async with self.session.post(f"{self.base_url}{self.urls['build']}", proxy=self.proxy, params={
+                "id": tb["slot_id"],
+                "gid": tb["building_id"]
+            }, json=produce_unit_payload) as response:
+                return {
+                    "slot_id": tb["slot_id"],
+                    "building_id": tb["building_id"],
+                    "produced": response.ok,
+                    "detail": produce_unit_payload
+                }
+
+        details = await asyncio.gather(*[submit(*_) for _ in jobs])
+        return {
+            "produced": bool(details) and all(_["produced"] for _ in details),
+            "details": details
+        }
+
+    async def upgrade(self, slot_id, building_id=None, dryrun=False):
+        logging.debug("Execute upgrading job.")
+        if not (1 <= slot_id <= 40):
+            logging.error("slot_id should between 1 and 40.")
+            return False
+        info = await self.get_info()
+        build_id = [_ for _ in info["resource_fields" if slot_id < 19 else "buildings"] if _["id"] == slot_id][0]["resource_id" if slot_id < 19 else "building_id"]
+        if slot_id < 19 or build_id:  # resource fields or already built up
+            action_page = await self.request("GET", self.urls["build"], params={
+                "id": slot_id,
+                "gid": build_id
+            })
+            action_info = {"slot_id": slot_id, "build_id": build_id}
+            action_info.update(await self.parse(lambda: self.parser.parse_upgrade(self.parser.soup(action_page))))
+            action_url = action_info.pop("url")
+            if action_info["demand"]["lumber"] > info["stock"]["warehouse_capacity"] or action_info["demand"]["clay"] > info["stock"]["warehouse_capacity"] or action_info["demand"]["iron"] > info["stock"]["warehouse_capacity"]:
+                logging.warning("Failed to upgrade, warehouse capacity is not enough.")
+                return {
+                    "upgrading": False,
+                    "action_info": action_info,
+                    "message": "extend warehouse first"
+                }
+            if action_info["demand"]["crop"] > info["stock"]["granary_capacity"]:
+                logging.warning("Failed to upgrade, granary capacity is not enough.")
+                return {
+                    "upgrading": False,
+                    "action_info": action_info,
+                    "message": "extend granary first"
+                }
+            if not action_url:
+                logging.warning("Failed to upgrade, resource is not affordable.")
+                return {
+                    "upgrading": False,
+                    "action_info": action_info,
+                    "message": "upgrade not available"
+                }
+            action_info["url"] = action_url
+        else:  # no building at an inner slot
+            action_pages = await asyncio.gather(*[self.request("GET", self.urls["build"], params={
+                "id": slot_id,
+                "category": i
+            }) for i in range(1, 4)])
+            action_soups = await self.parse(lambda: [self.parser.soup(_) for _ in action_pages])
+            available_buildings = self.parser.parse_available_buildings(action_soups)
+            if not building_id:
+                logging.warning("Build on an empty slot and building_id is required.")
+                return {
+                    "upgrading": False,
+                    "available_buildings": available_buildings,
+                    "message": "the slot is empty, building_id is needed"
+                }
+            if building_id not in [_["id"] for _ in available_buildings]:
+                logging.warning("This building is not available now.")
+                return {
+                    "upgrading": False,
+                    "available_buildings": available_buildings,
+                    "message": "building_id not available"
+                }
+            action_info = {"slot_id": slot_id, "build_id": building_id}
+            building_in_category = [_ for _ in available_buildings if _["id"] == building_id][0]["category"]
+            action_info.update(self.parser.parse_new_building(action_soups[building_in_category - 1], building_id))
+        if not dryrun:
+            await self.request("GET", action_info["url"])
+        logging.info(f"Upgrading slot_id={slot_id} now.")
+        return {
+            "upgrading": True,
+            "action_info": action_info,
+            "message": "ok"
+        }
+
+    async def hero_click(self, checksum, transfer_id, amount):
+        try:
+            async with self.session.post(f"{self.base_url}{self.urls['hero_click']}", proxy=self.proxy, json={
+                "action": "inventory",
+                "checksum": checksum,
+                "id": transfer_id,
+                "context": "inventory",
+                "amount": amount
+            }, headers={
+                "Authorization": f"Bearer {self.token}"
+            }) as response:
+                if not response.ok:
+                    return None
+                try:
+                    return (await response.json(content_type=None)) or {}
+                except ValueError:
+                    return {}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Hero click failed: {e}")
+            return None
+
+    async def transfer_resources_from_hero(self, resources=None):
+        hero_inventory, info = await asyncio.gather(self.get_hero_inventory(), self.get_info())
+        if not hero_inventory:
+            return {
+                "transferred": False,
+                "message": "failed to get hero's inventory"
+            }
+        amounts, message = hero_transfer_amounts(hero_inventory, info["stock"], resources)
+        if message:
+            logging.warning(f"Failed, {message}.")
+            return {
+                "transferred": False,
+                "message": message
+            }
+        checksum = hero_inventory["checksum"]
+        transferred, failed = {}, []
+        for resource, amount in amounts.items():
+            transfer_id = hero_inventory["resources"][resource]["transfer_id"]
+            before = hero_inventory["resources"][resource]["amount"]
+            result = await self.hero_click(checksum, transfer_id, amount)
+            if result is None:
+                #  a stale checksum is refused, but an error may also come after the click was applied
+                refreshed = await self.get_hero_inventory()
+                if refreshed:
+                    checksum = refreshed["checksum"]
+                    if refreshed["resources"][resource]["amount"] != before:
+                        result = {}
+                    else:
+                        result = await self.hero_click(checksum, transfer_id, amount)
+            if result is None:
+                logging.warning(f"Failed to transfer {amount} {resource} from hero's inventory.")
+                failed.append(resource)
+                continue
+            checksum = (result.get("checksum") if isinstance(result, dict) else None) or checksum
+            transferred[resource] = amount
+            logging.info(f"Transferred {amount} {resource} from hero's inventory to the village.")
+        current = await self.get_hero_inventory() if transferred else hero_inventory
+        return {
+            "transferred": bool(transferred),
+            "amounts": transferred,
+            "failed": failed,
+            "current_resources": {
+                resource: current["resources"][resource]["village"] for resource in current["resources"].keys()
+            } if current else None,
+            "message": "ok" if transferred and not failed else "nothing to transfer" if not amounts else f"failed to transfer {', '.join(failed)}"
+        }
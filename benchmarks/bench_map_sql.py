@@ -0,0 +1,47 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_sql import load_map_sql, parse_map_sql  # noqa: E402
+from tile_index import TileIndex  # noqa: E402
+
+
+def write_dump(path, rows):
+    random.seed(0)
+    #  larger than a real 401x401 map when more rows are asked for
+    size = max(401, int((rows * 2) ** 0.5) | 1)
+    coordinates = random.sample(range(size * size), rows)
+    with open(path, "w") as f:
+        for index, coordinate in enumerate(coordinates):
+            x, y = coordinate % size - size // 2, coordinate // size - size // 2
+            f.write(f"INSERT INTO `x_world` VALUES ({coordinate + 1},{x},{y},{random.randint(1, 3)},{index + 1},'Village {index}',{index // 3 + 1},'Player\\'s {index // 3}',{index % 50},'Alliance {index % 50}',{random.randint(2, 900)},'Region',{'TRUE' if index % 3 == 0 else 'FALSE'},NULL,FALSE,NULL);\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark map.sql parsing and ingesting.")
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        dump = os.path.join(directory, "map.sql")
+        write_dump(dump, args.rows)
+        print(f"synthetic dump: {args.rows} rows, {os.path.getsize(dump) / 1024 / 1024:.1f} MiB")
+        started = time.time()
+        with open(dump) as f:
+            count = sum(1 for _ in parse_map_sql(f))
+        elapsed = time.time() - started
+        print(f"parse only:    {count} rows in {elapsed:.2f}s, {count / elapsed:,.0f} rows/s")
+        index = TileIndex(os.path.join(directory, "tiles.db"))
+        result = load_map_sql(index, dump)
+        print(f"parse + load:  {result['rows']} rows in {result['seconds']:.2f}s, {result['rows_per_second']:,.0f} rows/s")
+        result = load_map_sql(index, dump)
+        print(f"reload:        {result['rows']} rows in {result['seconds']:.2f}s, {result['rows_per_second']:,.0f} rows/s")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from travian import Parser  # noqa: E402
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def parsers(parser):
+    return {
+        "dorf1": parser.parse_dorf1,
+        "dorf2": parser.parse_dorf2,
+        "build": lambda html: parser.parse_upgrade(parser.soup(html)),
+        "train": lambda html: parser.parse_units(parser.soup(html), 19),
+        "tile": parser.parse_tile,
+    }
+
+
+def available_backends():
+    backends = ["html.parser"]
+    for backend, module in [("lxml", "lxml"), ("html5lib", "html5lib")]:
+        try:
+            __import__(module)
+            backends.append(backend)
+        except ImportError:
+            pass
+    return backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML parsing per page and backend.")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--fixtures", default=FIXTURES, help="directory of saved pages, named dorf1.html, dorf2.html, build.html, train.html and tile_*.html")
+    args = parser.parse_args()
+    pages = {os.path.basename(path)[:-len(".html")]: open(path, encoding="utf-8").read() for path in sorted(glob.glob(os.path.join(args.fixtures, "*.html")))}
+    backends = available_backends()
+    print(f"{'page':<18}" + "".join(f"{_ + ' ms':>16}" for _ in backends))
+    for name, html in pages.items():
+        row = f"{name:<18}"
+        for backend in backends:
+            parse = parsers(Parser(backend))[name.split("_")[0]]
+            parse(html)
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                parse(html)
+            row += f"{(time.perf_counter() - started) * 1000 / args.rounds:>16.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import EconomySimulator  # noqa: E402
+from travian import Parser  # noqa: E402
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the build order simulator on a village seeded from saved pages.")
+    parser.add_argument("--plans", type=int, default=100000)
+    parser.add_argument("--length", type=int, default=30)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--objective", default="production")
+    parser.add_argument("--fixtures", default=FIXTURES, help="directory holding dorf1.html and dorf2.html")
+    args = parser.parse_args()
+    page_parser = Parser()
+    info = page_parser.parse_dorf1(open(os.path.join(args.fixtures, "dorf1.html"), encoding="utf-8").read())
+    info.update(page_parser.parse_dorf2(open(os.path.join(args.fixtures, "dorf2.html"), encoding="utf-8").read()))
+    simulator = EconomySimulator(info)
+    best = simulator.best_plan(count=args.plans, length=args.length, horizon=args.days * 86400, objective=args.objective, batch_size=args.batch_size, seed=0)
+    if best:
+        print(f"plans/sec: {best['plans_per_second']:.0f} ({best['valid_plans']}/{best['plans']} valid)")
+        print(f"best {best['objective']}: {best['score']:.1f}, {best['completed']} upgrades done in {best['finished_in'] / 3600:.1f}h")
+        print(f"plan: {best['plan']}")
+
+
+if __name__ == "__main__":
+    main()
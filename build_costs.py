@@ -0,0 +1,92 @@
+import math
+
+
+RESOURCES = ["lumber", "clay", "iron", "crop"]
+
+#  gid: name, cost of level 1, cost factor per level, max level, construction time (a, k, b) of a * k ^ (level - 1) - b seconds
+BUILDINGS = {
+    1: {"name": "woodcutter", "cost": [40, 100, 50, 60], "k": 1.67, "max_level": 20, "time": (1780 / 3, 1.6, 1000 / 3)},
+    2: {"name": "clay pit", "cost": [80, 40, 80, 50], "k": 1.67, "max_level": 20, "time": (1660 / 3, 1.6, 1000 / 3)},
+    3: {"name": "iron mine", "cost": [100, 80, 30, 60], "k": 1.67, "max_level": 20, "time": (2350 / 3, 1.6, 1000 / 3)},
+    4: {"name": "cropland", "cost": [70, 90, 70, 20], "k": 1.67, "max_level": 20, "time": (1450 / 3, 1.6, 1000 / 3)},
+    5: {"name": "sawmill", "cost": [520, 380, 290, 90], "k": 1.80, "max_level": 5, "time": (5400, 1.5, 2400)},
+    6: {"name": "brickyard", "cost": [440, 480, 320, 50], "k": 1.80, "max_level": 5, "time": (5400, 1.5, 2400)},
+    7: {"name": "iron foundry", "cost": [200, 450, 510, 120], "k": 1.80, "max_level": 5, "time": (5400, 1.5, 2400)},
+    8: {"name": "grain mill", "cost": [500, 440, 380, 1240], "k": 1.80, "max_level": 5, "time": (5400, 1.5, 2400)},
+    9: {"name": "bakery", "cost": [1200, 1480, 870, 1600], "k": 1.80, "max_level": 5, "time": (5400, 1.5, 2400)},
+    10: {"name": "warehouse", "cost": [130, 160, 90, 40], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    11: {"name": "granary", "cost": [80, 100, 70, 20], "k": 1.28, "max_level": 20, "time": (3200, 1.16, 1875)},
+    13: {"name": "smithy", "cost": [180, 250, 500, 160], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    14: {"name": "tournament square", "cost": [1750, 2250, 1530, 240], "k": 1.28, "max_level": 20, "time": (5375, 1.16, 1875)},
+    15: {"name": "main building", "cost": [70, 40, 60, 20], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    16: {"name": "rally point", "cost": [110, 160, 90, 70], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    17: {"name": "marketplace", "cost": [80, 70, 120, 70], "k": 1.28, "max_level": 20, "time": (3675, 1.16, 1875)},
+    18: {"name": "embassy", "cost": [180, 130, 150, 80], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    19: {"name": "barracks", "cost": [210, 140, 260, 120], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    20: {"name": "stable", "cost": [260, 140, 220, 100], "k": 1.28, "max_level": 20, "time": (4075, 1.16, 1875)},
+    21: {"name": "workshop", "cost": [460, 510, 600, 320], "k": 1.28, "max_level": 20, "time": (4875, 1.16, 1875)},
+    22: {"name": "academy", "cost": [220, 160, 90, 40], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    23: {"name": "cranny", "cost": [40, 50, 30, 10], "k": 1.28, "max_level": 10, "time": (2625, 1.16, 1875)},
+    24: {"name": "town hall", "cost": [1250, 1110, 1260, 600], "k": 1.28, "max_level": 20, "time": (14375, 1.16, 1875)},
+    25: {"name": "residence", "cost": [580, 460, 350, 180], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    26: {"name": "palace", "cost": [550, 800, 750, 250], "k": 1.28, "max_level": 20, "time": (6875, 1.16, 1875)},
+    27: {"name": "treasury", "cost": [2880, 2740, 2580, 990], "k": 1.26, "max_level": 20, "time": (9875, 1.16, 1875)},
+    28: {"name": "trade office", "cost": [1400, 1330, 1200, 400], "k": 1.28, "max_level": 20, "time": (4875, 1.16, 1875)},
+    29: {"name": "great barracks", "cost": [630, 420, 780, 360], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    30: {"name": "great stable", "cost": [780, 420, 660, 300], "k": 1.28, "max_level": 20, "time": (4075, 1.16, 1875)},
+    31: {"name": "city wall", "cost": [70, 90, 170, 70], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    32: {"name": "earth wall", "cost": [120, 200, 0, 80], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    33: {"name": "palisade", "cost": [160, 100, 0, 60], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    34: {"name": "stonemason's lodge", "cost": [155, 130, 125, 70], "k": 1.28, "max_level": 20, "time": (3875, 1.16, 1875)},
+    35: {"name": "brewery", "cost": [1460, 930, 1250, 1740], "k": 1.40, "max_level": 10, "time": (11750, 1.16, 3750)},
+    36: {"name": "trapper", "cost": [80, 120, 70, 90], "k": 1.28, "max_level": 20, "time": (2000, 1.16, 1875)},
+    37: {"name": "hero's mansion", "cost": [700, 670, 700, 240], "k": 1.33, "max_level": 20, "time": (2300, 1.16, 0)},
+    38: {"name": "great warehouse", "cost": [650, 800, 450, 200], "k": 1.28, "max_level": 20, "time": (10875, 1.16, 1875)},
+    39: {"name": "great granary", "cost": [400, 500, 350, 100], "k": 1.28, "max_level": 20, "time": (8875, 1.16, 1875)},
+    40: {"name": "wonder of the world", "cost": [66700, 69050, 72200, 13200], "k": 1.0275, "max_level": 100, "time": (60857, 1.014, 42857)},
+    41: {"name": "horse drinking trough", "cost": [780, 420, 660, 540], "k": 1.28, "max_level": 20, "time": (5950, 1.16, 1875)},
+    42: {"name": "great workshop", "cost": [1380, 1530, 1800, 960], "k": 1.28, "max_level": 20, "time": (9750, 1.16, 1875)},
+}
+
+#  hourly production of a resource field by level at speed 1
+FIELD_PRODUCTION = [3, 7, 13, 21, 31, 46, 70, 98, 140, 203, 280, 392, 525, 693, 889, 1120, 1400, 1820, 2240, 2800, 3430]
+
+#  capacity of a warehouse or granary by level, level 0 is the village without one
+CAPACITY = [800, 1200, 1700, 2300, 3100, 4000, 5000, 6300, 7800, 9600, 11800, 14400, 17600, 21400, 25900, 31300, 37900, 45700, 55100, 66400, 80000]
+
+
+def _round5(value):
+    return int(round(value / 5.0) * 5)
+
+
+#  cost of every level of every building, built once at import
+COSTS = {
+    gid: [None] + [{RESOURCES[index]: _round5(base * building["k"] ** (level - 1)) for index, base in enumerate(building["cost"])} for level in range(1, building["max_level"] + 1)]
+    for gid, building in BUILDINGS.items()
+}
+
+
+def get_cost(gid, level):
+    if gid not in COSTS or not (1 <= level < len(COSTS[gid])):
+        return None
+    return dict(COSTS[gid][level])
+
+
+def get_duration(gid, level, main_building_level=1, speed=1):
+    if gid not in BUILDINGS or not (1 <= level <= BUILDINGS[gid]["max_level"]):
+        return None
+    a, k, b = BUILDINGS[gid]["time"]
+    #  every main building level saves 3.6%, down to half of the time at level 20
+    factor = 0.964 ** (max(main_building_level, 1) - 1)
+    return int(math.ceil((a * k ** (level - 1) - b) * factor / speed))
+
+
+def format_duration(seconds):
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def compare_cost(gid, level, demand):
+    cost = get_cost(gid, level)
+    if cost is None:
+        return None
+    return {resource: (cost[resource], demand[resource]) for resource in RESOURCES if cost[resource] != demand.get(resource)}
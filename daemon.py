@@ -0,0 +1,204 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from travian import Travian, VillageInfo
+
+
+#  identical calls in flight share one upstream request
+READ_METHODS = ["get_info", "get_all_villages_info", "get_tile_info", "get_hero_inventory", "get_hero_attributes", "get_producible_units", "estimate_upgrade", "get_stats"]
+#  run one at a time
+WRITE_METHODS = ["upgrade", "produce_units", "transfer_resources_from_hero"]
+
+
+def to_json(value):
+    if isinstance(value, VillageInfo):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Coalescer(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+
+    def call(self, key, func):
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+
+class TravianDaemon(object):
+
+    def __init__(self, travian):
+        self.travian = travian
+        self.coalescer = Coalescer()
+        self.write_lock = threading.Lock()
+
+    def call(self, method, args=None, kwargs=None):
+        args = args or []
+        kwargs = kwargs or {}
+        if method in READ_METHODS:
+            key = json.dumps([method, args, kwargs], sort_keys=True)
+            #  serialized inside so every waiting caller gets the same plain result
+            return self.coalescer.call(key, lambda: json.loads(json.dumps(getattr(self.travian, method)(*args, **kwargs), default=to_json)))
+        if method in WRITE_METHODS:
+            with self.write_lock:
+                return getattr(self.travian, method)(*args, **kwargs)
+        raise AttributeError(f"unknown method {method}")
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        if self.request.family != socket.AF_UNIX:
+            #  headers and body are written separately, don't let Nagle hold the body back
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def reply(self, code, body):
+        data = json.dumps(body, default=to_json).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        method = self.path.strip("/")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            return self.reply(400, {"error": f"invalid request: {e}"})
+        try:
+            result = self.server.daemon.call(method, body.get("args"), body.get("kwargs"))
+        except AttributeError as e:
+            return self.reply(404, {"error": str(e)})
+        except Exception as e:
+            logging.exception(f"Failed to call {method}.")
+            return self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self.reply(200, {"result": result})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+    #  a full backlog makes clients with a timeout fail at once with EAGAIN instead of waiting
+    request_queue_size = 128
+
+
+def serve(travian, host="127.0.0.1", port=8765, unix_socket=None):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, RequestHandler)
+        logging.info(f"Serving on {unix_socket}.")
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+        server.daemon_threads = True
+        logging.info(f"Serving on {host}:{server.server_address[1]}.")
+    server.daemon = TravianDaemon(travian)
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DaemonClient(object):
+
+    def __init__(self, host="127.0.0.1", port=8765, unix_socket=None, timeout=300):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if not getattr(self.local, "connection", None):
+            if self.unix_socket:
+                self.local.connection = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+            else:
+                self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def call(self, method, *args, **kwargs):
+        body = json.dumps({"args": args, "kwargs": kwargs}).encode()
+        connection = self.connection()
+        try:
+            connection.request("POST", f"/{method}", body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read())
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(data.get("error"))
+        return data["result"]
+
+    def __getattr__(self, method):
+        if method not in READ_METHODS + WRITE_METHODS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep one logged in Travian session and serve it locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="serve on a Unix domain socket instead of TCP")
+    args = parser.parse_args()
+    server = serve(Travian(), host=args.host, port=args.port, unix_socket=args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import csv
+import logging
+import re
+import time
+
+import requests
+
+
+#  tid column of x_world
+TRIBES = {
+    1: "Romans",
+    2: "Teutons",
+    3: "Gauls",
+    4: "Nature",
+    5: "Natars",
+    6: "Egyptians",
+    7: "Huns",
+    8: "Spartans",
+    9: "Vikings",
+}
+
+#  columns of x_world read into a village, column 12 is the capital flag
+NUMBER_COLUMNS = [0, 1, 2, 3, 4, 6, 8, 10]
+TEXT_COLUMNS = [5, 7, 9]
+LITERALS = {"NULL": None, "TRUE": True, "FALSE": False}
+
+TOKEN_RE = re.compile(r"'([^'\\]*(?:(?:\\.|'')[^'\\]*)*)'|([^,()'\s]+)|([()])")
+ESCAPE_RE = re.compile(r"\\(.)|''")
+
+
+def _unescape(value):
+    if "\\" not in value and "''" not in value:
+        return value
+    return ESCAPE_RE.sub(lambda m: m.group(1) if m.group(1) is not None else "'", value)
+
+
+def _value(token):
+    #  checked before converting, raising on every NULL and boolean is slow
+    if (token[1:] if token[:1] == "-" else token).isdecimal():
+        return int(token)
+    return LITERALS.get(token.upper(), token)
+
+
+def parse_rows(line):
+    values = line.find("VALUES")
+    if values < 0:
+        return
+    row = None
+    for match in TOKEN_RE.finditer(line, values + len("VALUES")):
+        quoted, bare, paren = match.groups()
+        if paren == "(":
+            row = []
+        elif paren == ")":
+            if row is not None:
+                yield row
+            row = None
+        elif row is not None:
+            row.append(_unescape(quoted) if quoted is not None else _value(bare))
+
+
+def _csv_row(line, values):
+    start = line.find("(", values)
+    end = line.rfind(")")
+    if start < 0 or end < start:
+        return None
+    row = next(csv.reader([line[start + 1:end]], quotechar="'", escapechar="\\", doublequote=True, skipinitialspace=True), None)
+    if not row or len(row) < 11:
+        return row
+    #  same values as the tokenizer gives, e.g. None for an unquoted NULL
+    for index in NUMBER_COLUMNS:
+        try:
+            row[index] = int(row[index])
+        except ValueError:
+            row[index] = _value(row[index])
+    for index in TEXT_COLUMNS:
+        if row[index].upper() == "NULL":
+            row[index] = None
+    if len(row) > 12:
+        row[12] = _value(row[12])
+    return row
+
+
+def parse_map_sql(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        values = line.find("VALUES")
+        if values < 0:
+            continue
+        #  one row per line is the usual layout, the C csv reader parses it much faster than the tokenizer
+        if "),(" in line or "), (" in line:
+            rows = parse_rows(line)
+        else:
+            rows = [_csv_row(line, values)]
+        for row in rows:
+            if not row or len(row) < 11 or not all(isinstance(row[_], int) for _ in [1, 2, 3]):
+                logging.warning(f"Skipping malformed map.sql row: {row}")
+                continue
+            yield {
+                "x": row[1],
+                "y": row[2],
+                "type": "village",
+                "tribe": TRIBES.get(row[3], str(row[3])),
+                "owner": row[7],
+                "capital": bool(row[12]) if len(row) > 12 else False,
+                "village_id": row[4],
+                "village_name": row[5],
+                "player_id": row[6],
+                "alliance": row[9],
+                "alliance_id": row[8],
+                "population": row[10],
+            }
+
+
+def open_map_sql(source):
+    if source.startswith("http://") or source.startswith("https://"):
+        logging.info(f"Downloading {source}.")
+        response = requests.get(source, stream=True)
+        response.raise_for_status()
+        return response.iter_lines(decode_unicode=True)
+    return open(source, encoding="utf-8", errors="replace")
+
+
+def load_map_sql(index, source, batch_size=5000):
+    started = time.time()
+    lines = open_map_sql(source)
+    try:
+        count = index.update_villages(parse_map_sql(lines), batch_size=batch_size, full=True)
+    finally:
+        if hasattr(lines, "close"):
+            lines.close()
+    elapsed = time.time() - started
+    logging.info(f"Loaded {count} villages from {source} in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f} rows/s).")
+    return {
+        "rows": count,
+        "seconds": elapsed,
+        "rows_per_second": count / elapsed if elapsed else 0
+    }
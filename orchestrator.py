@@ -0,0 +1,151 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from daemon import READ_METHODS, WRITE_METHODS, to_json
+from travian import Throttle, Travian, load_config
+
+
+#  short names of the usual jobs
+JOBS = {
+    "snapshot": "get_all_villages_info",
+    "train": "produce_units",
+}
+
+
+def _shared(name):
+    return property(lambda self: self.values[name].value, lambda self, value: setattr(self.values[name], "value", value))
+
+
+class SharedThrottle(Throttle):
+
+    #  the bucket state lives in shared memory, every worker process takes its tokens from the same bucket
+    tokens = _shared("tokens")
+    updated = _shared("updated")
+    requests = _shared("requests")
+    waited = _shared("waited")
+    max_wait = _shared("max_wait")
+
+    def __init__(self, rate, capacity=None):
+        self.values = {name: multiprocessing.Value("d", 0.0, lock=False) for name in ["tokens", "updated", "requests", "waited", "max_wait"]}
+        super().__init__(rate, capacity)
+        self.lock = multiprocessing.Lock()
+
+
+def account_key(account):
+    return f"{account['username']}@{server_key(account)}"
+
+
+def server_key(account):
+    server = account["server"]
+    return urlparse(server if "://" in server else f"https://{server}").netloc
+
+
+#  per worker process: throttles by server and the logged in accounts, reused by later jobs
+_throttles = {}
+_travians = {}
+
+
+def _init_worker(throttles):
+    _throttles.update(throttles)
+
+
+def _run_job(account, method, args, kwargs):
+    key = account_key(account)
+    started = time.time()
+    try:
+        if key not in _travians:
+            _travians[key] = Travian(account, throttle=_throttles.get(server_key(account)))
+        travian = _travians[key]
+        if not travian.logged_in:
+            del _travians[key]
+            raise RuntimeError("not logged in")
+        #  plain data crosses the process boundary, not lazy VillageInfo objects
+        result = json.loads(json.dumps(getattr(travian, method)(*args, **kwargs), default=to_json))
+        return {"account": key, "result": result, "seconds": time.time() - started}
+    except Exception as e:
+        logging.exception(f"Failed to run {method} for {key}.")
+        return {"account": key, "error": f"{type(e).__name__}: {e}", "seconds": time.time() - started}
+
+
+class Orchestrator(object):
+
+    def __init__(self, accounts=None, workers=None, config_json=None):
+        config_json = config_json if config_json is not None else load_config()
+        #  the session file belongs to one account, every other account keeps its own default file
+        base = {k: v for k, v in config_json.items() if k not in ["accounts", "session_file"]}
+        self.accounts = []
+        for account in accounts if accounts is not None else config_json.get("accounts") or []:
+            account = dict(base, **account)
+            if not all(account.get(_) for _ in ["username", "password", "server"]):
+                logging.error(f"Skipping account {account.get('username')}, username, password and server are needed.")
+                continue
+            self.accounts.append(account)
+        self.workers = workers or min(len(self.accounts), os.cpu_count() or 1) or 1
+        #  every account stays on one worker process, which keeps its logged in session for the later jobs
+        self.shards = {account_key(account): index % self.workers for index, account in enumerate(self.accounts)}
+        #  one request budget per server, shared by all accounts and workers
+        self.throttles = {}
+        for account in self.accounts:
+            rate_limit = account.get("rate_limit", 10)
+            if rate_limit and server_key(account) not in self.throttles:
+                self.throttles[server_key(account)] = SharedThrottle(rate_limit, account.get("rate_burst"))
+        self.executors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        if self.executors is None:
+            self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(self.throttles,)) for _ in range(self.workers)]
+        return self.executors
+
+    def close(self):
+        if self.executors is not None:
+            for executor in self.executors:
+                executor.shutdown()
+            self.executors = None
+
+    def run(self, method, *args, accounts=None, per_account=None, **kwargs):
+        method = JOBS.get(method, method)
+        if method not in READ_METHODS + WRITE_METHODS:
+            raise AttributeError(f"unknown method {method}")
+        #  per_account maps an account key to the keyword arguments of its own job, e.g. its training plan
+        per_account = per_account or {}
+        targets = [_ for _ in self.accounts if accounts is None or account_key(_) in accounts or _["username"] in accounts]
+        executors = self.start()
+        started = time.time()
+        futures = [executors[self.shards[account_key(account)]].submit(_run_job, account, method, args, dict(kwargs, **per_account.get(account_key(account), {}))) for account in targets]
+        results = {}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["account"]] = result
+        logging.info(f"Ran {method} for {len(targets)} accounts in {time.time() - started:.2f}s.")
+        return results
+
+    def throttle_stats(self):
+        return {server: throttle.stats() for server, throttle in self.throttles.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a job for every account of config.json in a pool of processes.")
+    parser.add_argument("job", help=f"{', '.join(JOBS.keys())} or a method such as get_info")
+    parser.add_argument("--kwargs", default="{}", help="JSON keyword arguments of the job, e.g. a training plan")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    with Orchestrator(workers=args.workers) as orchestrator:
+        results = orchestrator.run(args.job, **json.loads(args.kwargs))
+        print(json.dumps({"results": results, "throttle": orchestrator.throttle_stats()}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import heapq
+import logging
+import time
+
+from travian import parse_duration
+
+
+#  estimate_upgrade messages of plan items that no amount of waiting makes buildable
+IMPOSSIBLE_MESSAGES = ["the slot is empty, building_id is needed", "cost unknown"]
+
+
+class BuildScheduler(object):
+
+    def __init__(self, travian, plan, margin=2, retry_interval=600, max_attempts=10, sleep=time.sleep):
+        self.travian = travian
+        #  plan items are slot ids or dicts with slot_id and optionally building_id for empty slots
+        self.plan = [_ if isinstance(_, dict) else {"slot_id": _} for _ in plan]
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.sleep = sleep
+        self.demands = {}  # plan index -> demand of the last attempt
+
+    def queue_free_in(self, info):
+        durations = [parse_duration(_["duration"]) for _ in info["building_list"]]
+        return max(durations) if durations else 0
+
+    def affordable_in(self, info, demand):
+        wait = 0
+        for resource in self.travian.mapping["resources_short"]:
+            missing = demand.get(resource, 0) - info["stock"][resource]
+            if missing <= 0:
+                continue
+            production = info["production"].get(resource, 0)
+            if production <= 0:
+                return None
+            wait = max(wait, missing / production * 3600)
+        return wait
+
+    def next_attempt_in(self, index, info):
+        queue_free = self.queue_free_in(info)
+        demand = self.demands.get(index)
+        if not demand:
+            #  from the cost table, no request needed
+            estimate = self.travian.estimate_upgrade(self.plan[index]["slot_id"], self.plan[index].get("building_id"), info=info)
+            demand = (estimate or {}).get("action_info", {}).get("demand")
+        if not demand:
+            #  nothing known about the cost yet, e.g. a new building not affordable yet
+            return queue_free + self.margin if queue_free else self.retry_interval
+        affordable = self.affordable_in(info, demand)
+        if affordable is None:
+            return None
+        return max(queue_free, affordable) + self.margin
+
+    def run(self):
+        results = []
+        attempts = {index: 0 for index in range(len(self.plan))}
+        #  (due time, plan index), earlier plan items win when due at the same time
+        info = self.travian.get_info()
+
+        def give_up(index, message):
+            logging.warning(f"Giving up slot_id={self.plan[index]['slot_id']}: {message}.")
+            results.append({"slot_id": self.plan[index]["slot_id"], "upgrading": False, "attempts": attempts[index], "message": message, "at": time.time()})
+
+        heap = []
+        for index, item in enumerate(self.plan):
+            estimate = self.travian.estimate_upgrade(item["slot_id"], item.get("building_id"), info=info)
+            if not estimate or estimate["message"] in IMPOSSIBLE_MESSAGES:
+                give_up(index, estimate["message"] if estimate else "invalid slot_id")
+                continue
+            next_in = self.next_attempt_in(index, info)
+            if next_in is None:
+                give_up(index, "not affordable with the current production")
+                continue
+            heap.append((time.time() + next_in - self.margin, index))
+        heapq.heapify(heap)
+
+        while heap:
+            due, index = heapq.heappop(heap)
+            item = self.plan[index]
+            wait = due - time.time()
+            if wait > 0:
+                logging.info(f"Sleeping {wait:.0f}s until slot_id={item['slot_id']} can be upgraded.")
+                self.sleep(wait)
+            result = self.travian.upgrade(item["slot_id"], item.get("building_id"))
+            attempts[index] += 1
+            if result and result.get("upgrading"):
+                results.append({"slot_id": item["slot_id"], "upgrading": True, "attempts": attempts[index], "message": "ok", "at": time.time()})
+                #  stock and queue changed, every pending item gets a new due time
+                pending = [_[1] for _ in heap]
+            else:
+                message = result.get("message") if result else "invalid slot_id"
+                if message not in ["upgrade not available", "building_id not available"]:
+                    give_up(index, message)
+                    continue
+                if result.get("action_info"):
+                    self.demands[index] = result["action_info"]["demand"]
+                pending = [index]
+            info = self.travian.get_info()
+            heap = [_ for _ in heap if _[1] not in pending]
+            for pending_index in pending:
+                next_in = self.next_attempt_in(pending_index, info)
+                if next_in is None or attempts[pending_index] >= self.max_attempts:
+                    give_up(pending_index, "not affordable with the current production" if next_in is None else "too many attempts")
+                    continue
+                heap.append((time.time() + next_in, pending_index))
+            heapq.heapify(heap)
+        return results
@@ -0,0 +1,172 @@
+import logging
+import time
+
+import numpy as np
+
+import build_costs
+
+
+MAX_GID = max(build_costs.BUILDINGS)
+MAX_LEVEL = max(_["max_level"] for _ in build_costs.BUILDINGS.values())
+
+#  cost of level l of gid g at COST_TABLE[g, l], levels that cannot be built cost inf
+COST_TABLE = np.full((MAX_GID + 1, MAX_LEVEL + 2, 4), np.inf)
+#  seconds at speed 1 with a level 1 main building
+DURATION_TABLE = np.full((MAX_GID + 1, MAX_LEVEL + 2), np.inf)
+for _gid, _building in build_costs.BUILDINGS.items():
+    for _level in range(1, _building["max_level"] + 1):
+        COST_TABLE[_gid, _level] = [build_costs.COSTS[_gid][_level][_] for _ in build_costs.RESOURCES]
+        DURATION_TABLE[_gid, _level] = build_costs.get_duration(_gid, _level)
+
+FIELD_PRODUCTION = np.array(build_costs.FIELD_PRODUCTION + [build_costs.FIELD_PRODUCTION[-1]] * (MAX_LEVEL + 1 - len(build_costs.FIELD_PRODUCTION)), dtype=float)
+CAPACITY = np.array(build_costs.CAPACITY + [build_costs.CAPACITY[-1]] * (MAX_LEVEL + 1 - len(build_costs.CAPACITY)), dtype=float)
+
+#  gid -> index of the resource whose fields it boosts by 5% per level
+BONUS_BUILDINGS = {5: 0, 6: 1, 7: 2, 8: 3}
+#  gid -> (index of warehouse or granary capacity, multiple of the capacity table)
+STORAGE_BUILDINGS = {10: (0, 1), 11: (1, 1), 38: (0, 3), 39: (1, 3)}
+MAIN_BUILDING = 15
+
+OBJECTIVES = ["production", "gathered"]
+
+
+class EconomySimulator(object):
+
+    def __init__(self, info, speed=1, weights=None):
+        self.speed = speed
+        #  how much every resource counts in a score, e.g. [1, 1, 1, 0.5]
+        self.weights = np.array(weights or [1, 1, 1, 1], dtype=float)
+        stock = info["stock"]
+        self.stock = np.array([stock[_] for _ in build_costs.RESOURCES], dtype=float)
+        self.capacity = np.array([stock["warehouse_capacity"], stock["granary_capacity"]], dtype=float)
+        self.production = np.array([info["production"].get(_, 0) for _ in build_costs.RESOURCES], dtype=float)
+        #  slot id -> gid and level, slot 0 is unused
+        self.gids = np.zeros(41, dtype=np.int64)
+        self.levels = np.zeros(41, dtype=np.int64)
+        for field in info["resource_fields"]:
+            self.gids[field["id"]], self.levels[field["id"]] = field["resource_id"], field["level"]
+        for building in info["buildings"]:
+            self.gids[building["id"]], self.levels[building["id"]] = building["building_id"], building["level"]
+        self.fields = self.field_production(self.gids[None, :], self.levels[None, :])[0]
+        self.bonus = self.bonus_levels(self.gids[None, :], self.levels[None, :])[0]
+        self.main_building = int(max([self.levels[_] for _ in range(19, 41) if self.gids[_] == MAIN_BUILDING] or [0]))
+
+    def upgradable_slots(self):
+        return [slot for slot in range(1, 41) if self.gids[slot] in build_costs.BUILDINGS and self.levels[slot] < build_costs.BUILDINGS[self.gids[slot]]["max_level"]]
+
+    def field_production(self, gids, levels):
+        #  base production of the resource fields per resource, rows are plans
+        fields = np.zeros((gids.shape[0], 4))
+        for index in range(4):
+            fields[:, index] = np.where(gids[:, 1:19] == index + 1, FIELD_PRODUCTION[levels[:, 1:19]], 0).sum(axis=1)
+        return fields
+
+    def bonus_levels(self, gids, levels):
+        bonus = np.zeros((gids.shape[0], 4))
+        for gid, index in BONUS_BUILDINGS.items():
+            bonus[:, index] = np.where(gids[:, 19:] == gid, levels[:, 19:], 0).max(axis=1)
+        return bonus
+
+    def random_plans(self, count, length, seed=None, slots=None):
+        rng = np.random.default_rng(seed)
+        slots = np.array(slots or self.upgradable_slots())
+        return slots[rng.integers(0, len(slots), size=(count, length))]
+
+    def simulate(self, plans, horizon=7 * 86400):
+        plans = np.asarray(plans, dtype=np.int64)
+        count, length = plans.shape
+        rows = np.arange(count)
+        gids = np.broadcast_to(self.gids, (count, 41))
+        levels = np.tile(self.levels, (count, 1))
+        stock = np.tile(self.stock, (count, 1))
+        capacity = np.tile(self.capacity, (count, 1))
+        fields = np.tile(self.fields, (count, 1))
+        bonus = np.tile(self.bonus, (count, 1))
+        main_building = np.full(count, self.main_building)
+        #  live production already holds oases, hero and upkeep, upgrades only add the difference of the fields
+        base = self.production - self.speed * self.fields * (1 + 0.05 * self.bonus)
+        production = np.tile(self.production, (count, 1))
+        now = np.zeros(count)
+        gathered = np.zeros(count)
+        completed = np.zeros(count, dtype=np.int64)
+        valid = np.ones(count, dtype=bool)
+
+        def advance(seconds, active):
+            #  resources accrue up to the capacity, only what is stored before the horizon is gathered
+            rate = production / 3600
+            limit = np.maximum(capacity[:, [0, 0, 0, 1]], stock)
+            before_horizon = np.minimum(now + seconds, horizon) - np.minimum(now, horizon)
+            stored = np.minimum(stock + rate * before_horizon[:, None], limit) - stock
+            gathered[active] += stored[active] @ self.weights
+            np.copyto(stock, np.minimum(stock + rate * seconds[:, None], limit), where=active[:, None])
+            now[active] += seconds[active]
+
+        for step in range(length):
+            slot = plans[:, step]
+            gid = gids[rows, slot]
+            level = np.minimum(levels[rows, slot] + 1, MAX_LEVEL + 1)
+            cost = COST_TABLE[gid, level]
+            #  a plan asking for more than a level exists or than the storage holds is dropped
+            valid &= np.isfinite(cost).all(axis=1) & (cost <= capacity[:, [0, 0, 0, 1]]).all(axis=1)
+            rate = production / 3600
+            missing = np.clip(cost - stock, 0, None)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                wait = np.where(missing > 0, missing / np.where(rate > 0, rate, 0), 0).max(axis=1)
+            valid &= np.isfinite(wait)
+            wait = np.where(valid, wait, 0)
+            advance(wait, valid)
+            stock[valid] -= cost[valid]
+            duration = np.where(valid, DURATION_TABLE[gid, level] * 0.964 ** (np.maximum(main_building, 1) - 1) / self.speed, 0)
+            #  one construction queue, the next upgrade starts when this one is done
+            advance(duration, valid)
+            done = valid & (now <= horizon)
+            completed += done
+            levels[rows[valid], slot[valid]] += 1
+            upgraded = rows[done]
+            slot, gid, level = slot[done], gid[done], level[done]
+            field = slot <= 18
+            fields[upgraded[field], gid[field] - 1] += FIELD_PRODUCTION[level[field]] - FIELD_PRODUCTION[level[field] - 1]
+            for bonus_gid, index in BONUS_BUILDINGS.items():
+                bonus[upgraded[gid == bonus_gid], index] += 1
+            for storage_gid, (index, multiple) in STORAGE_BUILDINGS.items():
+                storage = gid == storage_gid
+                capacity[upgraded[storage], index] += multiple * (CAPACITY[level[storage]] - CAPACITY[level[storage] - 1])
+            main_building[upgraded[gid == MAIN_BUILDING]] += 1
+            production = base + self.speed * fields * (1 + 0.05 * bonus)
+        finished_in = now.copy()
+        advance(np.maximum(horizon - now, 0), np.ones(count, dtype=bool))
+        return {
+            "valid": valid,
+            "production": np.where(valid, production @ self.weights, -np.inf),
+            "gathered": np.where(valid, gathered, -np.inf),
+            "finished_in": np.where(valid, finished_in, np.inf),
+            "completed": completed
+        }
+
+    def best_plan(self, plans=None, count=10000, length=30, horizon=7 * 86400, objective="production", batch_size=10000, seed=None):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"objective should be one of {', '.join(OBJECTIVES)}")
+        plans = np.asarray(plans, dtype=np.int64) if plans is not None else self.random_plans(count, length, seed)
+        started = time.perf_counter()
+        results = [self.simulate(plans[offset:offset + batch_size], horizon) for offset in range(0, len(plans), batch_size)]
+        elapsed = time.perf_counter() - started
+        scores = np.concatenate([_[objective] for _ in results])
+        finished_in = np.concatenate([_["finished_in"] for _ in results])
+        completed = np.concatenate([_["completed"] for _ in results])
+        #  the highest score, the earliest finish among equal scores
+        best = np.lexsort((finished_in, -scores))[0]
+        plans_per_second = len(plans) / elapsed if elapsed else float("inf")
+        logging.info(f"Simulated {len(plans)} plans in {elapsed:.3f}s, {plans_per_second:.0f} plans/sec.")
+        if not np.isfinite(scores[best]):
+            logging.warning("No plan can be built with the current capacities.")
+            return None
+        return {
+            "plan": [int(_) for _ in plans[best]],
+            "score": float(scores[best]),
+            "objective": objective,
+            "finished_in": float(finished_in[best]),
+            "completed": int(completed[best]),
+            "plans": len(plans),
+            "valid_plans": int(np.isfinite(scores).sum()),
+            "plans_per_second": plans_per_second
+        }
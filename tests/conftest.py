@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stand_in import StandIn  # noqa: E402
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def config(stand_in, tmp_path):
+    return {
+        "username": "tester",
+        "password": "pw",
+        "server": stand_in.url,
+        "session_file": str(tmp_path / "session.json"),
+        "rate_limit": 0,
+        "backoff": 0.01,
+        "timeout": [1, 0.5],
+    }
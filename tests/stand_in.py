@@ -0,0 +1,129 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+RESOURCES = ["lumber", "clay", "iron", "crop"]
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def tile_kind(x, y):
+    return ["village", "valley", "oasis", "wilderness"][(x * 7 + y * 3) % 4]
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, code=200, content_type="text/html", headers=None):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(code)
+        for k, v in dict(headers or {}, **{"Content-Type": content_type, "Content-Length": str(len(body))}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def fault(self, path):
+        #  queued per path: a status code to answer with, or "slow" to outlast the read timeout
+        faults = self.server.stand_in.faults.get(path)
+        if not faults:
+            return False
+        fault = faults.pop(0)
+        if fault == "slow":
+            time.sleep(self.server.stand_in.slow_seconds)
+            return False
+        self.reply("{}", code=fault, content_type="application/json", headers={"Retry-After": "0"} if fault == 429 else None)
+        return True
+
+    def logged_in(self):
+        cookie = self.headers.get("Cookie") or ""
+        return any(f"sess={_}" in cookie for _ in self.server.stand_in.sessions)
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        stand_in.hits[url.path] += 1
+        if url.path == "/":
+            return self.reply("<html><body>login</body></html>")
+        if not self.logged_in():
+            if url.path.startswith("/api/"):
+                return self.reply("{}", code=401, content_type="application/json")
+            return self.reply("", code=302, headers={"Location": "/"})
+        if "action" in query:
+            stand_in.hits["click"] += 1
+        if self.fault(url.path):
+            return
+        if url.path in ["/dorf1.php", "/dorf2.php"]:
+            return self.reply(fixture(url.path.strip("/").replace(".php", ".html")))
+        if url.path == "/build.php":
+            return self.reply(fixture("train.html" if query.get("gid") in [["19"], ["20"]] else "build.html"))
+        if url.path == "/api/v1/hero/v2/screen/inventory":
+            items = [{"name": resource.capitalize(), "alreadyEquipped": 1000, "amount": stand_in.inventory[resource], "id": index + 1, "maxInput": 3000} for index, resource in enumerate(RESOURCES)]
+            return self.reply(json.dumps({"checksum": "ck", "viewData": {"itemsInventory": items}}), content_type="application/json")
+        self.reply("not found", code=404)
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        url = urlparse(self.path)
+        stand_in.hits[url.path] += 1
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if url.path == "/api/v1/auth/login":
+            return self.reply(json.dumps({"nonce": "n1"}), content_type="application/json")
+        if url.path.startswith("/api/v1/auth/"):
+            with stand_in.lock:
+                session = f"s{len(stand_in.sessions) + stand_in.expired}"
+                stand_in.sessions.add(session)
+            return self.reply(json.dumps({"token": f"token-{session}"}), content_type="application/json", headers={"Set-Cookie": f"sess={session}; Path=/"})
+        if not self.logged_in():
+            return self.reply("{}", code=401, content_type="application/json")
+        if self.fault(url.path):
+            return
+        if url.path == "/api/v1/map/tile-details":
+            return self.reply(json.dumps({"html": fixture(f"tile_{tile_kind(data['x'], data['y'])}.html")}), content_type="application/json")
+        if url.path == "/api/v1/hero/v2/inventory/click":
+            stand_in.inventory[RESOURCES[data["id"] - 1]] -= data["amount"]
+            return self.reply("{}", content_type="application/json")
+        if url.path == "/build.php":
+            return self.reply(fixture("train.html"))
+        self.reply("not found", code=404)
+
+
+class StandIn(object):
+
+    def __init__(self, slow_seconds=1.0):
+        self.hits = collections.Counter()
+        self.faults = {}  # path -> list of faults for the next requests
+        self.sessions = set()
+        self.expired = 0
+        self.inventory = {_: 5000 for _ in RESOURCES}
+        self.slow_seconds = slow_seconds
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def expire(self):
+        #  every logged in session is logged out, like a server side timeout
+        with self.lock:
+            self.expired += len(self.sessions)
+            self.sessions.clear()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from async_travian import AsyncTravian
+
+
+@pytest.fixture
+def travian(config, tmp_path, monkeypatch):
+    #  AsyncTravian reads config.json of the working directory
+    (tmp_path / "config.json").write_text(json.dumps(config))
+    monkeypatch.chdir(tmp_path)
+    return AsyncTravian()
+
+
+def run(travian, func):
+    async def main():
+        async with travian:
+            return await func()
+    return asyncio.run(main())
+
+
+def test_get_info(travian, stand_in):
+    info = run(travian, travian.get_info)
+    assert info["stock"] and info["buildings"]
+    assert stand_in.hits["/api/v1/auth/login"] == 1
+
+
+def test_scan_tiles(travian, stand_in):
+    async def scan():
+        return dict([tile async for tile in travian.scan_tiles([(x, y) for x in range(3) for y in range(3)], rate=1000)])
+    tiles = run(travian, scan)
+    assert len(tiles) == 9 and all(tiles.values())
+
+
+def test_relogin_during_scan(travian, stand_in):
+    async def scan():
+        stand_in.expire()
+        stand_in.hits.clear()
+        return dict([tile async for tile in travian.scan_tiles([(x, y) for x in range(5) for y in range(5)], rate=1000)])
+    tiles = run(travian, scan)
+    assert len(tiles) == 25 and all(tiles.values())
+    assert stand_in.hits["/api/v1/auth/login"] == 1
+
+
+def test_start_again_after_close(travian, stand_in):
+    run(travian, travian.get_info)
+    assert travian.session is None and travian.executor is None
+    assert run(travian, travian.get_info)["stock"]
+    assert stand_in.hits["/api/v1/auth/login"] == 2
+
+
+def test_hero_click_is_repeated_when_refused(travian, stand_in):
+    stand_in.faults["/api/v1/hero/v2/inventory/click"] = [400]
+    result = run(travian, lambda: travian.transfer_resources_from_hero({"lumber": 100}))
+    assert result["amounts"] == {"lumber": 100}
+    assert stand_in.inventory["lumber"] == 4900
+    assert stand_in.hits["/api/v1/hero/v2/inventory/click"] == 2
@@ -0,0 +1,100 @@
+import pytest
+import requests
+
+from travian import Session, Travian
+
+
+@pytest.fixture
+def travian(config):
+    return Travian(config)
+
+
+def test_scan_region(travian, stand_in):
+    tiles = dict(travian.scan_region((0, 0), 3))
+    assert len(tiles) == 49
+    assert all(tiles.values())
+    assert {_["type"] for _ in tiles.values()} >= {"village", "oasis"}
+
+
+def test_scan_retries_server_errors(travian, stand_in):
+    stand_in.faults["/api/v1/map/tile-details"] = [503, 502, 500]
+    tiles = dict(travian.scan_region((0, 0), 1, workers=1))
+    assert len(tiles) == 9 and all(tiles.values())
+    assert stand_in.hits["/api/v1/map/tile-details"] == 12
+
+
+def test_relogin_during_scan(travian, stand_in):
+    stand_in.expire()
+    stand_in.hits.clear()
+    tiles = dict(travian.scan_region((0, 0), 3, workers=8))
+    assert len(tiles) == 49
+    assert all(tiles.values())
+    assert stand_in.hits["/api/v1/auth/login"] == 1
+
+
+def test_restore_session(config, stand_in):
+    Travian(config)
+    stand_in.hits.clear()
+    assert Travian(config).logged_in
+    assert stand_in.hits["/api/v1/auth/login"] == 0
+
+
+@pytest.mark.parametrize("fault", [429, 503, "slow"])
+def test_get_is_retried(travian, stand_in, fault):
+    stand_in.faults["/dorf2.php"] = [fault]
+    assert travian.s.get(f"{stand_in.url}/dorf2.php", cache=False).ok
+    assert stand_in.hits["/dorf2.php"] == 2
+
+
+def test_post_is_not_retried_on_server_errors(travian, stand_in):
+    stand_in.faults["/build.php"] = [503]
+    assert travian.s.post(f"{stand_in.url}/build.php", json={}).status_code == 503
+    assert stand_in.hits["/build.php"] == 1
+
+
+def test_post_is_retried_when_rate_limited(travian, stand_in):
+    stand_in.faults["/build.php"] = [429]
+    assert travian.s.post(f"{stand_in.url}/build.php", json={}).ok
+    assert stand_in.hits["/build.php"] == 2
+
+
+@pytest.mark.parametrize("fault", [503, "slow"])
+def test_action_get_is_sent_once(travian, stand_in, fault):
+    travian.get_info()
+    stand_in.faults["/dorf1.php"] = [fault]
+    try:
+        travian.upgrade(1)
+    except requests.Timeout:
+        pass
+    assert stand_in.hits["click"] == 1
+
+
+def test_retryable():
+    session = Session({"rate_limit": 0})
+    assert session.retryable(False, exception=requests.exceptions.ConnectTimeout())
+    assert not session.retryable(False, exception=requests.exceptions.ReadTimeout())
+    assert session.retryable(True, exception=requests.exceptions.ReadTimeout())
+
+
+def test_upgrade_invalidates_the_cache(travian, stand_in):
+    travian.get_info()["stock"]
+    stand_in.hits.clear()
+    assert travian.upgrade(1)["upgrading"]
+    travian.get_info()["stock"]
+    assert stand_in.hits["click"] == 1
+    assert stand_in.hits["/dorf1.php"] == 2
+
+
+def test_produce_units_invalidates_the_cache(travian, stand_in):
+    travian.get_info()["stock"]
+    stand_in.hits.clear()
+    assert travian.produce_units({"t1": 1})["produced"]
+    travian.get_info()["stock"]
+    assert stand_in.hits["/dorf1.php"] == 1
+
+
+def test_transfer_resources_from_hero(travian, stand_in):
+    result = travian.transfer_resources_from_hero({"lumber": 100})
+    assert stand_in.inventory["lumber"] == 4900
+    assert stand_in.hits["/api/v1/hero/v2/inventory/click"] == 1
+    assert result
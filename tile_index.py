@@ -0,0 +1,223 @@
+import json
+import logging
+import sqlite3
+import time
+
+from travian import MAP_RADIUS, region_coordinates, tile_distance
+
+
+class TileIndex(object):
+
+    def __init__(self, path="tiles.db"):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.create_function("tile_distance", 4, tile_distance, deterministic=True)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                x INTEGER NOT NULL,
+                y INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                lumber INTEGER,
+                clay INTEGER,
+                iron INTEGER,
+                crop INTEGER,
+                bonus_lumber INTEGER,
+                bonus_clay INTEGER,
+                bonus_iron INTEGER,
+                bonus_crop INTEGER,
+                animals INTEGER,
+                distribution TEXT,
+                troops TEXT,
+                owner TEXT,
+                tribe TEXT,
+                capital INTEGER,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (x, y)
+            );
+            CREATE INDEX IF NOT EXISTS tiles_type_crop ON tiles (type, crop);
+            CREATE INDEX IF NOT EXISTS tiles_type_animals ON tiles (type, animals);
+            CREATE INDEX IF NOT EXISTS tiles_owner ON tiles (owner);
+            CREATE INDEX IF NOT EXISTS tiles_last_seen ON tiles (last_seen);
+        """)
+        #  village columns only known from map.sql, added to databases created before them
+        self.village_columns = {
+            "village_id": "INTEGER",
+            "village_name": "TEXT",
+            "player_id": "INTEGER",
+            "alliance": "TEXT",
+            "alliance_id": "INTEGER",
+            "population": "INTEGER",
+        }
+        existing_columns = [row["name"] for row in self.db.execute("PRAGMA table_info(tiles)")]
+        for column, column_type in self.village_columns.items():
+            if column not in existing_columns:
+                self.db.execute(f"ALTER TABLE tiles ADD COLUMN {column} {column_type}")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tiles_player_id ON tiles (player_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tiles_alliance_id ON tiles (alliance_id)")
+        self.db.commit()
+        self.resources = ["lumber", "clay", "iron", "crop"]
+
+    def close(self):
+        self.db.close()
+
+    def _row(self, x, y, tile_info, last_seen):
+        row = {_: None for _ in ["lumber", "clay", "iron", "crop", "bonus_lumber", "bonus_clay", "bonus_iron", "bonus_crop", "animals", "distribution", "troops", "owner", "tribe", "capital"]}
+        row.update({"x": x, "y": y, "type": tile_info["type"], "last_seen": last_seen})
+        for resource_field in tile_info.get("resource_fields", []):
+            row[resource_field["type"]] = resource_field["count"]
+        if tile_info["type"] == "oasis":
+            for resource in self.resources:
+                row[f"bonus_{resource}"] = 0
+            for bonus in tile_info.get("distribution", []):
+                if bonus["resource"].lower() in self.resources:
+                    row[f"bonus_{bonus['resource'].lower()}"] = int(bonus["value"].strip().strip("%") or 0)
+            row["animals"] = sum(int(_["count"]) for _ in tile_info.get("troops", []))
+            row["distribution"] = json.dumps(tile_info.get("distribution", []))
+            row["troops"] = json.dumps(tile_info.get("troops", []))
+            row["owner"] = tile_info.get("owner")
+        if tile_info["type"] == "village":
+            row["owner"] = tile_info.get("owner")
+            row["tribe"] = tile_info.get("tribe")
+            row["capital"] = int(bool(tile_info.get("capital")))
+        return row
+
+    def _tile(self, row):
+        tile_info = {"x": row["x"], "y": row["y"], "type": row["type"], "last_seen": row["last_seen"]}
+        if row["type"] in ["village", "abandoned valley"] and row["crop"] is not None:
+            tile_info["resource_fields"] = [{"type": _, "count": row[_]} for _ in self.resources]
+        if row["type"] == "oasis":
+            tile_info["distribution"] = json.loads(row["distribution"] or "[]")
+            tile_info["troops"] = json.loads(row["troops"] or "[]")
+            tile_info["owner"] = row["owner"]
+        if row["type"] == "village":
+            tile_info["tribe"] = row["tribe"]
+            tile_info["owner"] = row["owner"]
+            tile_info["capital"] = bool(row["capital"])
+            for column in self.village_columns.keys():
+                if row[column] is not None:
+                    tile_info[column] = row[column]
+        return tile_info
+
+    def update(self, x, y, tile_info, last_seen=None, commit=True):
+        row = self._row(x, y, tile_info, last_seen or time.time())
+        self.db.execute(f"INSERT OR REPLACE INTO tiles ({', '.join(row.keys())}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+        if commit:
+            self.db.commit()
+
+    def update_villages(self, villages, batch_size=5000, last_seen=None, full=False):
+        columns = ["x", "y", "type", "owner", "tribe", "capital", "last_seen"] + list(self.village_columns.keys())
+        #  keep the resource fields of tiles already fetched through get_tile_info
+        sql = f"INSERT INTO tiles ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT (x, y) DO UPDATE SET " + ", ".join(f"{_} = excluded.{_}" for _ in columns[2:])
+        last_seen = last_seen or time.time()
+        count = 0
+        batch = []
+        for village in villages:
+            batch.append([village["x"], village["y"], "village", village.get("owner"), village.get("tribe"), int(bool(village.get("capital"))), last_seen] + [village.get(_) for _ in self.village_columns.keys()])
+            if len(batch) >= batch_size:
+                self.db.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.db.executemany(sql, batch)
+            count += len(batch)
+        if full and count:
+            #  a village missing from a whole dump was destroyed, its fields stay as an abandoned valley
+            cleared = ", ".join(f"{_} = NULL" for _ in ["owner", "tribe", "capital"] + list(self.village_columns.keys()))
+            removed = self.db.execute(f"UPDATE tiles SET type = 'abandoned valley', {cleared} WHERE type = 'village' AND last_seen < ?", (last_seen,)).rowcount
+            if removed:
+                logging.info(f"Marked {removed} villages missing from the dump as abandoned valleys.")
+        self.db.commit()
+        return count
+
+    def get(self, x, y):
+        row = self.db.execute("SELECT * FROM tiles WHERE x = ? AND y = ?", (x, y)).fetchone()
+        return self._tile(row) if row else None
+
+    def query(self, center=None, radius=None, limit=None, **conditions):
+        sql = "SELECT * FROM tiles"
+        where = []
+        params = []
+        for column, value in conditions.items():
+            if column.endswith("_min") or column.endswith("_max"):
+                where.append(f"{column[:-4]} {'>=' if column.endswith('_min') else '<='} ?")
+                params.append(value)
+            elif value is None:
+                where.append(f"{column} IS NULL")
+            elif isinstance(value, (list, tuple)):
+                where.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                where.append(f"{column} = ?")
+                params.append(value)
+        order = ""
+        if center is not None:
+            if isinstance(center, dict):
+                center = (center["x"], center["y"])
+            if radius is not None:
+                #  bounding box first so the primary key can be used, the map wraps so skip it near the edges
+                if all(-MAP_RADIUS <= c - radius and c + radius <= MAP_RADIUS for c in center):
+                    where.append("x BETWEEN ? AND ? AND y BETWEEN ? AND ?")
+                    params.extend([center[0] - radius, center[0] + radius, center[1] - radius, center[1] + radius])
+                where.append("tile_distance(x, y, ?, ?) <= ?")
+                params.extend([center[0], center[1], radius])
+            order = " ORDER BY tile_distance(x, y, ?, ?)"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if order:
+            sql += order
+            params.extend(center)
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        tiles = []
+        for row in self.db.execute(sql, params):
+            tile_info = self._tile(row)
+            if center is not None:
+                tile_info["distance"] = round(tile_distance(row["x"], row["y"], center[0], center[1]), 2)
+            tiles.append(tile_info)
+        return tiles
+
+    def find_valleys(self, center, radius, crop=15, limit=None):
+        return self.query(center=center, radius=radius, limit=limit, type="abandoned valley", crop=crop)
+
+    def find_oases(self, center, radius, animals=False, bonus=None, limit=None):
+        #  only oases no player holds
+        conditions = {"type": "oasis", "owner": None}
+        if animals is False:
+            conditions["animals"] = 0
+        elif animals is True:
+            conditions["animals_min"] = 1
+        if bonus:
+            conditions[f"bonus_{bonus}_min"] = 25
+        return self.query(center=center, radius=radius, limit=limit, **conditions)
+
+    def stale(self, coordinates, ttl):
+        deadline = time.time() - ttl
+        fresh = set()
+        coordinates = list(coordinates)
+        for start in range(0, len(coordinates), 400):
+            chunk = coordinates[start:start + 400]
+            sql = "SELECT x, y FROM tiles WHERE last_seen >= ? AND (" + " OR ".join(["(x = ? AND y = ?)"] * len(chunk)) + ")"
+            params = [deadline] + [c for coordinate in chunk for c in coordinate]
+            fresh.update((row["x"], row["y"]) for row in self.db.execute(sql, params))
+        return [_ for _ in coordinates if _ not in fresh]
+
+    def refresh(self, travian, center, radius, ttl=86400, **scan_kwargs):
+        coordinates = region_coordinates(center, radius)
+        stale = self.stale(coordinates, ttl)
+        logging.info(f"Refreshing {len(stale)} of {len(coordinates)} tiles, the others are younger than {ttl}s.")
+        result = {
+            "fetched": 0,
+            "skipped": len(coordinates) - len(stale),
+            "failed": 0
+        }
+        for (x, y), tile_info in travian.scan_tiles(stale, **scan_kwargs):
+            if tile_info is None:
+                result["failed"] += 1
+                continue
+            self.update(x, y, tile_info, commit=False)
+            result["fetched"] += 1
+            if result["fetched"] % 100 == 0:
+                self.db.commit()
+        self.db.commit()
+        return result
@@ -1,81 +1,545 @@
+import functools
+import hashlib
 import json
 import logging
 import os
+import random
 import re
+import threading
+import time
+
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 
 import requests
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+import build_costs
 
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s - %(message)s")
 
+MAP_RADIUS = 200  # coordinates run from -200 to 200 and wrap around
+
+#  statuses worth repeating a request for, 429 is the server throttling
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+#  sections of one page read one by one before the rest of the page is parsed in a single pass
+STRAINED_SECTIONS = 2
+
+URLS = {
+    "login": "/api/v1/auth/login",
+    "dorf1": "/dorf1.php",
+    "dorf2": "/dorf2.php",
+    "tile": "/api/v1/map/tile-details",
+    "build": "/build.php",
+    "hero_inventory": "/api/v1/hero/v2/screen/inventory",
+    "hero_click": "/api/v1/hero/v2/inventory/click",
+    "hero_attributes": "/hero/attributes",
+    "hero_appearance": "/hero/appearance",
+}
+
+PRODUCIBLE_BUILDINGS = [
+    19,  # Barrack
+    20,  # Stable
+    21,  # Workshop
+    25,  # Residence
+    26,  # Palace
+]
+
+
+def wrap_coordinate(value):
+    size = 2 * MAP_RADIUS + 1
+    return (value + MAP_RADIUS) % size - MAP_RADIUS
+
+
+def region_coordinates(center, radius):
+    if isinstance(center, dict):
+        center = (center["x"], center["y"])
+    cx, cy = center
+    #  nearest tiles first so callers can act on them early
+    offsets = sorted(((dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)), key=lambda d: max(abs(d[0]), abs(d[1])))
+    coordinates = []
+    seen = set()
+    for dx, dy in offsets:
+        coordinate = (wrap_coordinate(cx + dx), wrap_coordinate(cy + dy))
+        if coordinate not in seen:
+            seen.add(coordinate)
+            coordinates.append(coordinate)
+    return coordinates
+
+
+def tile_distance(x1, y1, x2, y2):
+    size = 2 * MAP_RADIUS + 1
+    dx = abs(x1 - x2) % size
+    dy = abs(y1 - y2) % size
+    return ((min(dx, size - dx)) ** 2 + (min(dy, size - dy)) ** 2) ** 0.5
+
+
+def hero_transfer_amounts(inventory, stock, resources=None):
+    #  None as the resources or as an amount moves as much as the hero has and the village can take
+    resources = resources if resources is not None else {_: None for _ in inventory["resources"]}
+    amounts = {}
+    for resource, amount in resources.items():
+        item = inventory["resources"][resource]
+        capacity = stock["granary_capacity" if resource == "crop" else "warehouse_capacity"]
+        limit = max(min(item["max_transfer"], capacity - stock[resource]), 0)
+        if amount is None:
+            amount = min(item["amount"], limit)
+        elif amount > item["amount"]:
+            return None, "no enough resource in hero's invetory"
+        elif amount > limit:
+            return None, "no enough space for warehouse or granary"
+        if amount > 0:
+            amounts[resource] = amount
+    return amounts, None
+
+
+def load_config(config_file="config.json"):
+    try:
+        with open(config_file) as f:
+            return json.load(f)
+    except Exception as e:
+        return {}
+
+
+def parse_duration(duration):
+    seconds = 0
+    for part in duration.strip().split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        #  takes a token now or in the future, returns how long to wait for it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Throttle(TokenBucket):
+
+    def __init__(self, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.requests = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        wait = super().acquire()
+        with self.lock:
+            self.requests += 1
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "requests": self.requests,
+                "waited_seconds": self.waited,
+                "average_wait": self.waited / self.requests if self.requests else 0.0,
+                "max_wait": self.max_wait
+            }
+
+
+THROTTLES = {}
+THROTTLES_LOCK = threading.Lock()
+
+
+def shared_throttle(key, rate, capacity=None):
+    #  one bucket per way out, every Session of the process using the same proxy shares it
+    with THROTTLES_LOCK:
+        if key not in THROTTLES:
+            THROTTLES[key] = Throttle(rate, capacity)
+        return THROTTLES[key]
+
+
+class PageCache(object):
+
+    def __init__(self, ttls=None):
+        self.ttls = ttls or {}  # url path -> seconds
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, url, params=None):
+        if isinstance(params, dict):
+            params = tuple(sorted((k, str(v)) for k, v in params.items()))
+        return (url, params)
+
+    def ttl(self, url):
+        return self.ttls.get(urlparse(url).path, 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl):
+        if ttl > 0:
+            now = time.monotonic()
+            with self.lock:
+                #  entries of pages never asked for again, e.g. other villages, would stay forever
+                for expired in [k for k, entry in self.entries.items() if entry[0] <= now]:
+                    del self.entries[expired]
+                self.entries[key] = (now + ttl, value)
+
+    def invalidate(self, *paths):
+        with self.lock:
+            if not paths:
+                self.entries.clear()
+                return
+            for key in list(self.entries.keys()):
+                if urlparse(key[0]).path in paths or key[0] in paths:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries)
+            }
+
+
+class SessionStats(object):
+
+    def __init__(self, enabled=False, hook=None):
+        self.enabled = enabled
+        self.hook = hook  # called with every recorded request or method
+        self.buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]  # upper bounds of latency buckets in seconds
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.methods = {}
+
+    def counters(self):
+        #  one counter per measured method running on this thread, innermost last
+        return getattr(self.local, "counters", [])
+
+    def bind(self, function):
+        #  requests made by worker threads are credited to the methods measured by the thread handing out the work
+        counters = self.counters()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            previous = self.counters()
+            self.local.counters = counters
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.counters = previous
+        return wrapper
+
+    def endpoint_stats(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {
+                "count": 0,
+                "cached": 0,
+                "seconds": 0.0,
+                "latency": {str(_): 0 for _ in self.buckets + ["inf"]},
+                "status": {},
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "retries": 0,
+                "throttled_seconds": 0.0
+            }
+        return self.endpoints[endpoint]
+
+    def record_request(self, endpoint, method, seconds, status, bytes_in, bytes_out):
+        bucket = next((str(_) for _ in self.buckets if seconds <= _), "inf")
+        with self.lock:
+            for counter in self.counters():
+                counter["network"] += seconds
+            stats = self.endpoint_stats(endpoint)
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["latency"][bucket] += 1
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+        if self.hook:
+            self.hook({"type": "request", "endpoint": endpoint, "method": method, "seconds": seconds, "status": status, "bytes_in": bytes_in, "bytes_out": bytes_out})
+
+    def record_parse(self, seconds):
+        with self.lock:
+            for counter in self.counters():
+                counter["parse"] += seconds
+
+    @contextmanager
+    def parsing(self):
+        #  a parser call made inside another one is timed once, by the outer call
+        if not self.enabled or getattr(self.local, "parsing", False):
+            yield
+            return
+        self.local.parsing = True
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.parsing = False
+            self.record_parse(time.perf_counter() - started)
+
+    def record_cached(self, endpoint):
+        with self.lock:
+            self.endpoint_stats(endpoint)["cached"] += 1
+
+    def record_retry(self, endpoint, delay):
+        with self.lock:
+            self.endpoint_stats(endpoint)["retries"] += 1
+            for counter in self.counters():
+                counter["wait"] += delay
+
+    def record_throttled(self, endpoint, seconds):
+        with self.lock:
+            self.endpoint_stats(endpoint)["throttled_seconds"] += seconds
+            for counter in self.counters():
+                counter["wait"] += seconds
+
+    @contextmanager
+    def measure(self, name):
+        if not self.enabled:
+            yield
+            return
+        previous = self.counters()
+        counter = {"network": 0.0, "wait": 0.0, "parse": 0.0}
+        self.local.counters = previous + [counter]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.local.counters = previous
+            with self.lock:
+                network, wait, parse = counter["network"], counter["wait"], counter["parse"]
+                stats = self.methods.setdefault(name, {"count": 0, "seconds": 0.0, "network_seconds": 0.0, "wait_seconds": 0.0, "parse_seconds": 0.0})
+                stats["count"] += 1
+                stats["seconds"] += seconds
+                stats["network_seconds"] += network
+                stats["wait_seconds"] += wait
+                stats["parse_seconds"] += parse
+            if self.hook:
+                self.hook({"type": "method", "method": name, "seconds": seconds, "network_seconds": network, "wait_seconds": wait, "parse_seconds": parse})
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                "endpoints": self.endpoints,
+                "methods": self.methods
+            }))
+
+
+def timed(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.stats is None:
+            return method(self, *args, **kwargs)
+        with self.stats.parsing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def instrumented(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.s.stats.measure(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class Session(object):
 
-    def __init__(self):
+    def __init__(self, config_json=None, throttle=None):
         self.session = requests.Session()
-        config_file = "config.json"
-        try:
-            with open(config_file) as f:
-                config_json = json.load(f)
-        except Exception as e:
-            config_json = {}
+        if config_json is None:
+            config_json = load_config()
         self.proxy = config_json.get("proxy") or None
+        #  keep enough pooled connections for the concurrent scanners
+        pool_size = int(config_json.get("pool_size") or 10)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache = PageCache()
+        self.stats = SessionStats(bool(config_json.get("stats")))
+        timeout = config_json.get("timeout") or 30
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout  # seconds, or [connect, read]
+        self.retries = int(config_json.get("retries", 3))
+        self.backoff = float(config_json.get("backoff") or 1.0)
+        self.max_backoff = float(config_json.get("max_backoff") or 30)
+        #  requests per second, 0 turns throttling off
+        rate_limit = config_json.get("rate_limit", 10)
+        self.throttle = throttle or (shared_throttle(self.proxy or "direct", rate_limit, config_json.get("rate_burst")) if rate_limit else None)
+        self.endpoints = {}  # url path -> endpoint name used in the stats
+        #  called when a response shows the session was logged out, returns the new bearer token or None
+        self.on_logged_out = None
+        #  set while this thread logs in, other threads wait for relogin_lock and repeat with the new token
+        self.auth_local = threading.local()
+        self.relogin_lock = threading.Lock()
+        self.token = None
+
+    @property
+    def authenticating(self):
+        return getattr(self.auth_local, "authenticating", False)
+
+    @authenticating.setter
+    def authenticating(self, value):
+        self.auth_local.authenticating = value
 
-    def get(self, url, *args, **kwargs):
+    def logged_out(self, response):
+        if response.status_code == 401:
+            return True
+        #  pages redirect to the login page once the session expired
+        return bool(response.history) and urlparse(response.url).path in ["/", "/login.php"]
+
+    def relogin(self, token):
+        with self.relogin_lock:
+            if self.token != token:
+                return self.token  # another thread logged in again meanwhile
+            logging.warning("Session is logged out, logging in again.")
+            self.authenticating = True
+            try:
+                return self.on_logged_out()
+            finally:
+                self.authenticating = False
+
+    def endpoint(self, url):
+        path = urlparse(url).path
+        if path in self.endpoints:
+            return self.endpoints[path]
+        return "auth" if path.startswith("/api/v1/auth/") else path
+
+    def retryable(self, idempotent, response=None, exception=None):
+        #  actions are only repeated when the server surely did not run them
+        if exception is not None:
+            return idempotent or isinstance(exception, requests.exceptions.ConnectTimeout)
+        return response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+
+    def retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.5)
+
+    def send(self, method, url, *args, idempotent=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        #  GETs that run an action, such as a build click, are retried like POSTs
+        idempotent = method == "GET" if idempotent is None else idempotent
+        endpoint = self.endpoint(url)
+        for attempt in range(self.retries + 1):
+            if self.throttle:
+                wait = self.throttle.acquire()
+                if wait and self.stats.enabled:
+                    self.stats.record_throttled(endpoint, wait)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or not self.retryable(idempotent, exception=e):
+                    raise
+                delay = self.retry_delay(attempt)
+                logging.warning(f"{method} {endpoint} failed: {e}, retrying in {delay:.2f}s.")
+            else:
+                if self.stats.enabled:
+                    self.stats.record_request(endpoint, method, time.perf_counter() - started, response.status_code, len(response.content), len(response.request.body or b""))
+                if attempt == self.retries or not self.retryable(idempotent, response=response):
+                    return response
+                delay = self.retry_delay(attempt, response)
+                logging.warning(f"{method} {endpoint} returned {response.status_code}, retrying in {delay:.2f}s.")
+            if self.stats.enabled:
+                self.stats.record_retry(endpoint, delay)
+            time.sleep(delay)
+
+    def request(self, method, url, *args, **kwargs):
+        token = self.token
+        response = self.send(method, url, *args, **kwargs)
+        if self.on_logged_out and not self.authenticating and self.logged_out(response):
+            token = self.relogin(token)
+            if token:
+                headers = kwargs.get("headers")
+                if headers and "Authorization" in headers:
+                    kwargs["headers"] = dict(headers, Authorization=f"Bearer {token}")
+                response = self.send(method, url, *args, **kwargs)
+        return response
+
+    def get(self, url, *args, cache=True, idempotent=True, **kwargs):
         kwargs['proxies'] = {
             "http": self.proxy,
             "https": self.proxy
         } if self.proxy else None
-        return self.session.get(url, *args, **kwargs)
+        ttl = self.cache.ttl(url) if cache else 0
+        if ttl:
+            key = self.cache.key(url, kwargs.get("params"))
+            response = self.cache.get(key)
+            if response is not None:
+                logging.debug(f"Cache hit for {url}.")
+                if self.stats.enabled:
+                    self.stats.record_cached(self.endpoint(url))
+                return response
+        response = self.request("GET", url, *args, idempotent=idempotent, **kwargs)
+        if ttl and response.ok and not self.logged_out(response):
+            self.cache.set(key, response, ttl)
+        return response
 
     def post(self, url, *args, **kwargs):
         kwargs['proxies'] = {
             "http": self.proxy,
             "https": self.proxy
         } if self.proxy else None
-        return self.session.post(url, *args, **kwargs)
+        return self.request("POST", url, *args, **kwargs)
 
 
-class Travian(object):
+def default_parser():
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
 
-    def __init__(self):
-        config_file = "config.json"
-        try:
-            with open(config_file) as f:
-                config_json = json.load(f)
-        except Exception as e:
-            config_json = {}
-        self.username = config_json.get("username") or os.getenv("tr_username")
-        if not self.username:
-            logging.error("Login failed, username is not given.")
-            exit()
-        self.password = config_json.get("password") or os.getenv("tr_password")
-        if not self.password:
-            logging.error("Login failed, password is not given.")
-            exit()
-        self.server = config_json.get("server") or os.getenv("tr_server")
-        if not self.server:
-            logging.error("Login failed, server is not given.")
-            exit()
-        self.s = Session()
+
+class Parser(object):
+
+    def __init__(self, backend=None, stats=None):
+        self.backend = backend or default_parser()
+        self.stats = stats  # SessionStats the parsing time is credited to
         self.mapping = {
             "resources_short": ["lumber", "clay", "iron", "crop"],
             "resources_long": ["lumber", "clay", "iron", "crop", "free_crop"],
             "resources_overall": ["overall", "lumber", "clay", "iron", "crop"]
         }
-        self.urls = {
-            "login": "/api/v1/auth/login",
-            "dorf1": "/dorf1.php",
-            "dorf2": "/dorf2.php",
-            "tile": "/api/v1/map/tile-details",
-            "build": "/build.php",
-            "hero_inventory": "/api/v1/hero/v2/screen/inventory",
-            "hero_click": "/api/v1/hero/v2/inventory/click",
-            "hero_attributes": "/hero/attributes",
-            "hero_appearance": "/hero/appearance",
-        }
         self.selectors = {
             "dorf1_player_name": "div#sidebarBoxActiveVillage div.playerName",
             "dorf1_stock": "div#stockBar",
@@ -86,130 +550,159 @@ class Travian(object):
             "dorf1_building_list": "div.buildingList ul li",
             "dorf1_village_list": "div#sidebarBoxVillagelist div.villageList div.listEntry",
             "dorf1_loyalty": "div#sidebarBoxActiveVillage div.loyalty span",
+            "dorf1_culture_points": "div.expansionSlotInfo",
             "dorf2_buildings": "div#villageContent div",
         }
-        self.producible_buildings = [
-            19,  # Barrack
-            20,  # Stable
-            21,  # Workshop
-            25,  # Residence
-            26,  # Palace
-        ]
-        self.logged_in = self.login()
+        self.dorf1_sections = ["stock", "production", "resource_fields", "troops", "movements", "building_list", "village_list", "loyalty", "culture_points"]
+        self.dorf2_sections = ["buildings"]
+        #  the smallest part of the page every section needs, the rest of the page is not built into the tree
+        #  classes are matched by regex since newer bs4 compares the whole class attribute while straining
+        self.strainers = {
+            "player_name": SoupStrainer("div", id="sidebarBoxActiveVillage"),
+            "stock": SoupStrainer("div", id="stockBar"),
+            "production": SoupStrainer("div", class_=re.compile(r"\bvillageInfobox\b")),
+            "resource_fields": SoupStrainer("div", id="resourceFieldContainer"),
+            "troops": SoupStrainer("div", class_=re.compile(r"\bvillageInfobox\b")),
+            "movements": SoupStrainer("div", class_=re.compile(r"\bvillageInfobox\b")),
+            "building_list": SoupStrainer("div", class_=re.compile(r"\bbuildingList\b")),
+            "village_list": SoupStrainer("div", id="sidebarBoxVillagelist"),
+            "loyalty": SoupStrainer("div", id="sidebarBoxActiveVillage"),
+            "culture_points": SoupStrainer("div", class_=re.compile(r"\bexpansionSlotInfo\b")),
+            "buildings": SoupStrainer("div", id="villageContent"),
+        }
+        self.slot_re = re.compile(r"\bbuildingSlot(\d+)\b")
+        self.gid_re = re.compile(r"\bgid(\d+)\b")
+        self.level_re = re.compile(r"\blevel(\d+)\b")
+        self.culture_points_re = re.compile(r"\d+\/\d+")
+        self.newdid_re = re.compile(r"newdid=(\d+)")
+        self.screen_data_re = re.compile(".*screenData.*")
+        #  raw markup of a section, cut out of the page without building a tree
+        self.raw_section_res = {
+            "movements": re.compile(r"<table[^>]*\bid=\"movements\".*?</table>", re.S),
+            "troops": re.compile(r"<table[^>]*\bid=\"troops\".*?</table>", re.S),
+        }
+        self.timer_re = re.compile(r"(<span[^>]*\btimer\b[^>]*>).*?</span>", re.S)
+        self.timer_value_re = re.compile(r"\bvalue=\"[^\"]*\"")
 
-    def login(self):
-        logging.debug("Start logging in.")
-        nonce_json = self.s.post(f"https://{self.server}{self.urls['login']}", json={
-            "name": self.username,
-            "password": self.password,
-            "w": "1440:900",
-            "mobileOptimizations": False
-        }).json()
-        nonce = nonce_json.get("nonce")
-        logging.debug(f"login nonce: {nonce}")
-        if nonce:
-            token_json = self.s.post(f"https://{self.server}/api/v1/auth/{nonce}").json()
-            token = token_json.get("token")
-            logging.debug(f"login token: {token}")
-            self.token = token
-            test_login = self.s.get(f"https://{self.server}{self.urls['dorf1']}")
-            soup = BeautifulSoup(test_login.text, "html.parser")
-            if soup.select(self.selectors["dorf1_player_name"]) and (soup.select(self.selectors["dorf1_player_name"])[0].string == self.username):
-                logging.info(f"Login successfully, username: {self.username}")
-                return True
-            logging.error("Login failed, cannot get the username.")
-        else:
-            logging.error("Login failed, cannot get the nonce.")
-        return False
+    @timed
+    def soup(self, markup, parse_only=None):
+        return BeautifulSoup(markup, self.backend, parse_only=parse_only)
 
-    def get_info(self):
-        info = {}
-        # dorf1
-        logging.debug("Getting info from dorf1.")
-        dorf1_page = self.s.get(f"https://{self.server}{self.urls['dorf1']}")
-        soup_dorf1 = BeautifulSoup(dorf1_page.text, "html.parser")
-        logging.debug("Got dorf1 page.")
-        stock = soup_dorf1.select(self.selectors["dorf1_stock"])[0]
-        info["stock"] = {}
-        info["stock"]["warehouse_capacity"] = int(stock.select(".warehouse .capacity")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["lumber"] = int(stock.select(".warehouse .stockBarButton")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["clay"] = int(stock.select(".warehouse .stockBarButton")[1].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["iron"] = int(stock.select(".warehouse .stockBarButton")[2].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["granary_capacity"] = int(stock.select(".granary .capacity")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["crop"] = int(stock.select(".granary .stockBarButton")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        info["stock"]["free_crop"] = int(stock.select(".granary .stockBarButton")[1].get_text().encode('ascii', 'ignore').decode('unicode_escape').replace(",", ""))
-        production = soup_dorf1.select(self.selectors["dorf1_production"])
-        info["production"] = {self.mapping["resources_short"][index]: int(_.select("td.num")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape')) for index, _ in enumerate(production[:len(self.mapping["resources_short"])])}
-        resource_fields = soup_dorf1.select(self.selectors["dorf1_resource_fields"])
-        info["resource_fields"] = []
-        for resource_field in resource_fields:
+    def text(self, tag):
+        return tag.get_text().encode('ascii', 'ignore').decode('unicode_escape')
+
+    def number(self, tag):
+        return int(self.text(tag).replace(",", ""))
+
+    def parse_player_name(self, soup):
+        player_name = soup.select(self.selectors["dorf1_player_name"])
+        return player_name[0].string if player_name else None
+
+    def parse_stock(self, soup):
+        stock = soup.select(self.selectors["dorf1_stock"])[0]
+        warehouse = stock.select(".warehouse .stockBarButton")
+        granary = stock.select(".granary .stockBarButton")
+        return {
+            "warehouse_capacity": self.number(stock.select(".warehouse .capacity")[0]),
+            "lumber": self.number(warehouse[0]),
+            "clay": self.number(warehouse[1]),
+            "iron": self.number(warehouse[2]),
+            "granary_capacity": self.number(stock.select(".granary .capacity")[0]),
+            "crop": self.number(granary[0]),
+            "free_crop": self.number(granary[1])
+        }
+
+    def parse_production(self, soup):
+        production = soup.select(self.selectors["dorf1_production"])
+        return {self.mapping["resources_short"][index]: int(self.text(_.select("td.num")[0])) for index, _ in enumerate(production[:len(self.mapping["resources_short"])])}
+
+    def parse_resource_fields(self, soup):
+        resource_fields = []
+        for resource_field in soup.select(self.selectors["dorf1_resource_fields"]):
+            classes = " ".join(resource_field.get("class"))
             rf = {
-                "id": int([re.match("buildingSlot(\d+)", _).group(1) for _ in resource_field.get("class") if re.match("buildingSlot\d+", _)][0]),
-                "resource_id": int([re.match("gid(\d+)", _).group(1) for _ in resource_field.get("class") if re.match("gid\d+", _)][0]),
-                "level": int([re.match("level(\d+)", _).group(1) for _ in resource_field.get("class") if re.match("level\d+", _)][0])
+                "id": int(self.slot_re.search(classes).group(1)),
+                "resource_id": int(self.gid_re.search(classes).group(1)),
+                "level": int(self.level_re.search(classes).group(1))
             }
             rf["name"] = self.mapping["resources_overall"][rf["resource_id"]]
-            info["resource_fields"].append(rf)
-        troops = soup_dorf1.select(self.selectors["dorf1_troops"])
+            resource_fields.append(rf)
+        return resource_fields
+
+    def parse_troops(self, soup):
+        troops = soup.select(self.selectors["dorf1_troops"])
         if troops[0].select("td.noTroops"):
-            info["troops"] = {}
-        else:
-            info["troops"] = [{
-                "name": _.select("td.un")[0].get_text(),
-                "count": int(_.select("td.num")[0].get_text())
-            } for _ in troops]
-        movements = soup_dorf1.select(self.selectors["dorf1_movements"])
-        info["movements"] = {
+            return {}
+        return [{
+            "name": _.select("td.un")[0].get_text(),
+            "count": int(_.select("td.num")[0].get_text())
+        } for _ in troops]
+
+    def parse_movements(self, soup):
+        movements = soup.select(self.selectors["dorf1_movements"])
+        result = {
             "outgoing": [],
             "incoming": []
         }
         if movements:
             direction = None
             for movement in movements[0].select("tr"):
-                if "Incoming" in movement.get_text():
+                movement_text = movement.get_text()
+                if "Incoming" in movement_text:
                     direction = "incoming"
                     continue
-                if "Outgoing" in movement.get_text():
+                if "Outgoing" in movement_text:
                     direction = "outgoing"
                     continue
                 if direction:
-                    info["movements"][direction].append({
-                        "type": movement.select("div.mov")[0].get_text().split()[1],
-                        "count": int(movement.select("div.mov")[0].get_text().split()[0]),
+                    mov = movement.select("div.mov")[0].get_text().split()
+                    result[direction].append({
+                        "type": mov[1],
+                        "count": int(mov[0]),
                         "duration": movement.select("div.dur_r span.timer")[0].get_text()
                     })
-        building_list = soup_dorf1.select(self.selectors["dorf1_building_list"])
-        info["building_list"] = []
-        if building_list:
-            for bl in building_list:
-                info["building_list"].append({
-                    "name": list(bl.select("div.name")[0].strings)[0].strip(),
-                    "level": bl.select("div.name span.lvl")[0].get_text(),
-                    "duration": bl.select("div.buildDuration span.timer")[0].get_text()
-                })
-        village_list = soup_dorf1.select(self.selectors["dorf1_village_list"])
-        info["village_list"] = [{
+        return result
+
+    def parse_building_list(self, soup):
+        return [{
+            "name": list(bl.select("div.name")[0].strings)[0].strip(),
+            "level": bl.select("div.name span.lvl")[0].get_text(),
+            "duration": bl.select("div.buildDuration span.timer")[0].get_text()
+        } for bl in soup.select(self.selectors["dorf1_building_list"])]
+
+    def parse_village_id(self, entry):
+        if entry.get("data-did"):
+            return int(entry.get("data-did"))
+        link = entry.select("a[href*='newdid=']")
+        if link:
+            return int(self.newdid_re.search(link[0].get("href")).group(1))
+        return None
+
+    def parse_village_list(self, soup):
+        return [{
+            "id": self.parse_village_id(_),
             "name": _.select("span.name")[0].get_text(),
             "coordinates": {
-                "x": int(_.select("span.coordinatesGrid span.coordinateX")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').strip("(")),
-                "y": int(_.select("span.coordinatesGrid span.coordinateY")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape').strip(")")),
+                "x": int(self.text(_.select("span.coordinatesGrid span.coordinateX")[0]).strip("(")),
+                "y": int(self.text(_.select("span.coordinatesGrid span.coordinateY")[0]).strip(")")),
             },
             "current": "active" in _.get("class")
-        } for _ in village_list]
-        info["loyalty"] = soup_dorf1.select(self.selectors["dorf1_loyalty"])[0].get_text().encode('ascii', 'ignore').decode('unicode_escape')
-        culture_points = re.findall('\d+\/\d+', soup_dorf1.select("div.expansionSlotInfo")[0].get("title").encode('ascii', 'ignore').decode('unicode_escape'))[-1]
-        info["culture_points"] = {
-            "current": int(culture_points.split("/")[0]),
-            "next_village": int(culture_points.split("/")[1])
+        } for _ in soup.select(self.selectors["dorf1_village_list"])]
+
+    def parse_loyalty(self, soup):
+        return self.text(soup.select(self.selectors["dorf1_loyalty"])[0])
+
+    def parse_culture_points(self, soup):
+        title = soup.select(self.selectors["dorf1_culture_points"])[0].get("title")
+        culture_points = self.culture_points_re.findall(title.encode('ascii', 'ignore').decode('unicode_escape'))[-1].split("/")
+        return {
+            "current": int(culture_points[0]),
+            "next_village": int(culture_points[1])
         }
-        # dorf2
-        logging.debug("Getting info from dorf2.")
-        dorf2_page = self.s.get(f"https://{self.server}{self.urls['dorf2']}")
-        soup_dorf2 = BeautifulSoup(dorf2_page.text, "html.parser")
-        logging.debug("Got dorf2 page.")
-        buildings = soup_dorf2.select(self.selectors["dorf2_buildings"])
-        info["buildings"] = []
-        for building in buildings:
+
+    def parse_buildings(self, soup):
+        buildings = []
+        for building in soup.select(self.selectors["dorf2_buildings"]):
             if building.get("data-aid"):
                 b = {
                     "id": int(building.get("data-aid")),
@@ -217,32 +710,440 @@ class Travian(object):
                     "name": building.get("data-name"),
                     "level": int(building.select("a")[0]["data-level"]) if building.get("data-name") else 0
                 }
-            if b not in info["buildings"]:
-                info["buildings"].append(b)
+                if b not in buildings:
+                    buildings.append(b)
+        return buildings
+
+    @timed
+    def parse_section(self, html, section):
+        soup = self.soup(html, parse_only=self.strainers[section]) if self.backend != "html5lib" else self.soup(html)
+        return getattr(self, f"parse_{section}")(soup)
+
+    def raw_section(self, html, section):
+        match = self.raw_section_res[section].search(html)
+        return match.group(0) if match else None
+
+    def section_digest(self, raw):
+        #  countdowns tick on every request, they are left out so an unchanged section keeps its digest
+        stable = self.timer_re.sub(lambda m: self.timer_value_re.sub("", m.group(1)), raw or "")
+        return hashlib.sha1(stable.encode()).hexdigest()
+
+    @timed
+    def parse_raw_section(self, raw, section):
+        #  the selectors expect the table inside its info box
+        return getattr(self, f"parse_{section}")(self.soup(f"<div class=\"villageInfobox\">{raw or ''}</div>"))
+
+    @timed
+    def parse_dorf1(self, html):
+        soup = self.soup(html)
+        return {section: getattr(self, f"parse_{section}")(soup) for section in self.dorf1_sections}
+
+    @timed
+    def parse_dorf2(self, html):
+        soup = self.soup(html)
+        return {section: getattr(self, f"parse_{section}")(soup) for section in self.dorf2_sections}
+
+    @timed
+    def parse_hero_attributes(self, html):
+        soup = self.soup(html)
+        hero_attr_raw = json.loads("".join([line for line in soup.find(string=self.screen_data_re).split("\n") if "screenData" in line][0].split(":", 1)[1:]).strip(","))  # too hardcode
+        return {
+            "attribute_points": hero_attr_raw["hero"]["attributePoints"],
+            "attack_behaviour": hero_attr_raw["hero"]["attackBehaviour"],
+            "experience": hero_attr_raw["hero"]["experience"],
+            "experience_percent": hero_attr_raw["hero"]["experiencePercent"],
+            "health": round(hero_attr_raw["hero"]["health"], 2),
+            "speed": hero_attr_raw["hero"]["speed"],
+            "production": [{
+                "name": _,
+                "value": hero_attr_raw["hero"]["productionTypes"][index]
+            } for index, _ in enumerate(self.mapping["resources_overall"])]
+        }
+
+    @timed
+    def parse_hero_inventory(self, inventory_raw):
+        inventory = {}
+        inventory["checksum"] = inventory_raw["checksum"]
+        inventory["resources"] = {_: {} for _ in self.mapping["resources_short"]}
+        for resource in inventory["resources"].keys():
+            inventory_resource = [_ for _ in inventory_raw["viewData"]["itemsInventory"] if _["name"] == resource.capitalize()][0]
+            inventory["resources"][resource] = {
+                "village": inventory_resource["alreadyEquipped"],
+                "amount": inventory_resource["amount"],
+                "transfer_id": inventory_resource["id"],
+                "max_transfer": inventory_resource["maxInput"]
+            }
+        return inventory
+
+    @timed
+    def parse_tile(self, html):
+        soup_tile = self.soup(html)
+        tile_info = {}
+        map_details = soup_tile.select("div#map_details")
+        if not map_details:
+            tile_info["type"] = "wilderness"
+            return tile_info
+        map_details = map_details[0]
+        tile_classes = soup_tile.select("div#tileDetails")[0].get("class")
+        if "oasis" in tile_classes:
+            tile_info["type"] = "oasis"
+            tile_info["distribution"] = []
+            for _ in map_details.select("table#distribution tr"):
+                desc, val = _.select("td.desc"), _.select("td.val")
+                if desc and val:
+                    tile_info["distribution"].append({
+                        "resource": desc[0].get_text(),
+                        "value": self.text(val[0])
+                    })
+            tile_info["troops"] = []
+            for _ in map_details.select("table#troop_info tr"):
+                desc, val = _.select("td.desc"), _.select("td.val")
+                if desc and val:
+                    tile_info["troops"].append({
+                        "name": desc[0].get_text(),
+                        "count": self.text(val[0])
+                    })
+            #  an occupied oasis lists the player holding it like a village does
+            owner = map_details.select("table#village_info td.player")
+            tile_info["owner"] = owner[0].get_text() if owner else None
+        elif "village" in tile_classes:
+            resource_field_types = self.mapping["resources_short"]
+            village_info = map_details.select("table#village_info")
+            if village_info:
+                tile_info["resource_fields"] = [{
+                    "type": resource_field_types[index],
+                    "count": int(_.get_text())
+                } for index, _ in enumerate(map_details.select("table#distribution td"))]
+                village_info = village_info[0]
+                tile_info["type"] = "village"
+                tile_info["tribe"] = village_info.select("tr.first td")[0].get_text()
+                tile_info["owner"] = village_info.select("td.player")[0].get_text()
+                tile_info["capital"] = True if soup_tile.select("h1 span.mainVillage") else False
+            else:
+                tile_info["type"] = "abandoned valley"
+                vals = [_.select("td.val") for _ in map_details.select("table#distribution tr")]
+                tile_info["resource_fields"] = [{
+                    "type": resource_field_types[index],
+                    "count": int(_[0].get_text())
+                } for index, _ in enumerate([_ for _ in vals if _])]
+        return tile_info
+
+    @timed
+    def parse_upgrade(self, soup):
+        action_demand = soup.select("div#contract div.resource")
+        action_info = {
+            "demand": {self.mapping["resources_long"][index]: int(_.get_text()) for index, _ in enumerate(action_demand[:len(self.mapping["resources_long"])])},
+            "duration": soup.select("div.duration")[0].get_text(),
+            "url": None
+        }
+        action_button = soup.select("div.upgradeButtonsContainer button")[0]
+        if "green" in action_button.get("class"):
+            action_info["url"] = action_button.get("onclick").split("'")[1]
+        return action_info
+
+    @timed
+    def parse_available_buildings(self, soups):
+        available_buildings = []
+        for index, soup in enumerate(soups):
+            for _ in soup.select("div#build div.buildingWrapper"):
+                if _.select("button.green"):
+                    available_buildings.append({
+                        "id": int(re.search(r"\d+", _.select("div.contract")[0].get("id")).group()),
+                        "name": _.select("h2")[0].get_text().lower(),
+                        "category": index + 1
+                    })
+        return available_buildings
+
+    @timed
+    def parse_new_building(self, soup, building_id):
+        contract = soup.select(f"div#contract_building{building_id}")[0]
+        action_demand = contract.select("div.resource")
+        return {
+            "demand": {self.mapping["resources_long"][index]: int(_.get_text()) for index, _ in enumerate(action_demand[:len(self.mapping["resources_long"])])},
+            "duration": contract.select("div.duration")[0].get_text(),
+            "url": contract.select("button.green")[0].get("onclick").split("'")[1]
+        }
+
+    def parse_units(self, soup, building_id):
+        units = []
+        for _ in soup.select("div.trainUnits div.troop div.details"):
+            units.append({
+                "demand": {
+                    self.mapping["resources_long"][index]: resource.get_text()
+                for index, resource in enumerate(_.select("div.resource"))},
+                "duration": _.select("div.duration")[0].get_text(),
+                "max_production": int(_.select("a[href='#']")[0].get_text()),
+                "troop_type": _.select("input")[0].get("name"),
+                "troop_name": _.select("img")[0].get("alt"),
+                "building_id": building_id
+            })
+        return units
+
+    def parse_train_form(self, soup):
+        form = soup.select("form[name='snd']")
+        if not form:
+            return None
+        form = form[0]
+        return {
+            "action": form.select("input[name='action']")[0].get("value"),
+            "checksum": form.select("input[name='checksum']")[0].get("value"),
+            "s": int(form.select("input[name='s']")[0].get("value")),
+            "did": int(form.select("input[name='did']")[0].get("value")),
+            "s1": form.select("button[name='s1']")[0].get("value")
+        }
+
+    @timed
+    def parse_training(self, html, building_id):
+        #  units and the form to train them come from one tree
+        soup = self.soup(html)
+        return {
+            "units": self.parse_units(soup, building_id),
+            "form": self.parse_train_form(soup)
+        }
+
+
+class VillageInfo(Mapping):
+
+    def __init__(self, travian, params=None, pages=None):
+        self.travian = travian
+        self.params = params  # e.g. {"newdid": ...} for a village other than the active one
+        self.pages = dict(pages or {})
+        self.sections = {section: "dorf1" for section in travian.parser.dorf1_sections}
+        self.sections.update({section: "dorf2" for section in travian.parser.dorf2_sections})
+        self.parsed = {}
+        self.lock = threading.RLock()
+
+    def page(self, name):
+        with self.lock:
+            if name not in self.pages:
+                logging.debug(f"Getting info from {name}.")
+                self.pages[name] = self.travian.s.get(f"{self.travian.base_url}{self.travian.urls[name]}", params=self.params).text
+                logging.debug(f"Got {name} page.")
+            return self.pages[name]
+
+    def missing(self, name):
+        return [section for section, page in self.sections.items() if page == name and section not in self.parsed]
+
+    def parse_page(self, name):
+        #  every section left from one tree of the whole page
+        with self.lock:
+            with self.travian.s.stats.measure("get_info"):
+                parsed = getattr(self.travian.parser, f"parse_{name}")(self.page(name))
+            for section in self.missing(name):
+                self.parsed[section] = parsed[section]
+
+    def __getitem__(self, section):
+        if section not in self.sections:
+            raise KeyError(section)
+        with self.lock:
+            if section not in self.parsed:
+                name = self.sections[section]
+                missing = self.missing(name)
+                if len(missing) > 1 and sum(1 for _ in self.sections.values() if _ == name) - len(missing) >= STRAINED_SECTIONS:
+                    self.parse_page(name)
+                else:
+                    with self.travian.s.stats.measure("get_info"):
+                        self.parsed[section] = self.travian.parser.parse_section(self.page(name), section)
+            return self.parsed[section]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __repr__(self):
+        return f"VillageInfo(parsed={list(self.parsed.keys())})"
+
+    def to_dict(self):
+        with self.lock:
+            for name in set(self.sections.values()):
+                if len(self.missing(name)) > 1:
+                    self.parse_page(name)
+            return {section: self[section] for section in self.sections}
+
+    def __reduce__(self):
+        #  pickled (e.g. to other processes) as a plain dict of all the sections
+        return (dict, (self.to_dict(),))
+
+
+class Travian(object):
+
+    def __init__(self, config_json=None, throttle=None):
+        #  a dict such as one entry of "accounts" replaces config.json
+        config_json = config_json if config_json is not None else load_config()
+        self.username = config_json.get("username") or os.getenv("tr_username")
+        if not self.username:
+            logging.error("Login failed, username is not given.")
+            exit()
+        self.password = config_json.get("password") or os.getenv("tr_password")
+        if not self.password:
+            logging.error("Login failed, password is not given.")
+            exit()
+        self.server = config_json.get("server") or os.getenv("tr_server")
+        if not self.server:
+            logging.error("Login failed, server is not given.")
+            exit()
+        self.base_url = self.server if "://" in self.server else f"https://{self.server}"
+        self.speed = float(config_json.get("speed") or os.getenv("tr_speed") or 1)
+        self.s = Session(config_json, throttle=throttle)
+        self.parser = Parser(config_json.get("parser"), stats=self.s.stats)
+        self.mapping = self.parser.mapping
+        self.urls = dict(URLS)
+        #  seconds a fetched page stays valid, pages changed by an action are invalidated right after it
+        self.cache_ttls = {
+            "dorf1": 5,
+            "dorf2": 30,
+            "build": 5,
+            "hero_inventory": 5,
+            "hero_attributes": 60,
+        }
+        self.cache_ttls.update(config_json.get("cache_ttl") or {})
+        self.s.cache.ttls = {self.urls[k]: v for k, v in self.cache_ttls.items() if k in self.urls}
+        self.s.endpoints = {v: k for k, v in self.urls.items()}
+        self.selectors = self.parser.selectors
+        self.producible_buildings = list(PRODUCIBLE_BUILDINGS)
+        self.token = None
+        self.session_file = config_json.get("session_file") or f".session-{self.username}@{urlparse(self.base_url).netloc}.json"
+        self.s.on_logged_out = lambda: self.token if self.login() else None
+        self.logged_in = self.restore_session() or self.login()
+
+    def save_session(self):
+        #  the file is private from its creation on and replaces the old one at once, readers never see half of it
+        temp_file = f"{self.session_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                json.dump({
+                    "username": self.username,
+                    "server": self.server,
+                    "token": self.token,
+                    "cookies": requests.utils.dict_from_cookiejar(self.s.session.cookies)
+                }, f)
+            os.replace(temp_file, self.session_file)
+        except OSError as e:
+            logging.warning(f"Failed to save the session to {self.session_file}: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def restore_session(self):
+        saved = load_config(self.session_file)
+        if not saved or saved.get("username") != self.username or saved.get("server") != self.server:
+            return False
+        logging.debug(f"Restoring the session from {self.session_file}.")
+        self.s.session.cookies.update(requests.utils.cookiejar_from_dict(saved.get("cookies") or {}))
+        self.token = self.s.token = saved.get("token")
+        #  the dorf1 page of the check stays cached for the first get_info
+        self.s.authenticating = True
+        try:
+            check = self.s.get(f"{self.base_url}{self.urls['dorf1']}")
+        finally:
+            self.s.authenticating = False
+        if not self.s.logged_out(check) and self.parser.parse_section(check.text, "player_name") == self.username:
+            logging.info(f"Restored the session, username: {self.username}")
+            return True
+        logging.info("Saved session is not valid anymore.")
+        self.s.session.cookies.clear()
+        self.s.cache.invalidate()
+        return False
+
+    @instrumented
+    def login(self):
+        logging.debug("Start logging in.")
+        self.s.cache.invalidate()
+        authenticating = self.s.authenticating
+        self.s.authenticating = True
+        try:
+            return self._login()
+        finally:
+            self.s.authenticating = authenticating
+
+    def _login(self):
+        nonce_json = self.s.post(f"{self.base_url}{self.urls['login']}", json={
+            "name": self.username,
+            "password": self.password,
+            "w": "1440:900",
+            "mobileOptimizations": False
+        }).json()
+        nonce = nonce_json.get("nonce")
+        logging.debug(f"login nonce: {nonce}")
+        if nonce:
+            token_json = self.s.post(f"{self.base_url}/api/v1/auth/{nonce}").json()
+            token = token_json.get("token")
+            logging.debug(f"login token: {token}")
+            self.token = self.s.token = token
+            test_login = self.s.get(f"{self.base_url}{self.urls['dorf1']}")
+            if self.parser.parse_section(test_login.text, "player_name") == self.username:
+                logging.info(f"Login successfully, username: {self.username}")
+                self.save_session()
+                return True
+            logging.error("Login failed, cannot get the username.")
+        else:
+            logging.error("Login failed, cannot get the nonce.")
+        return False
+
+    def get_info(self):
+        cache_key = self.s.cache.key("get_info")
+        info = self.s.cache.get(cache_key)
+        if info is None:
+            info = VillageInfo(self)
+            self.s.cache.set(cache_key, info, self.cache_ttls["dorf1"])
         return info
 
+    @instrumented
+    def get_all_villages_info(self, workers=4):
+        village_list = self.get_info()["village_list"]
+        current = [_["id"] for _ in village_list if _["current"]]
+
+        def fetch(village):
+            try:
+                return VillageInfo(self, params={"newdid": village["id"]}).to_dict()
+            except (requests.RequestException, IndexError, AttributeError, ValueError) as e:
+                logging.error(f"Failed to get info of village {village['name']}: {e}")
+                return None
+
+        logging.info(f"Getting info of {len(village_list)} villages.")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(self.s.stats.bind(fetch), village_list))
+        #  every newdid request switches the active village, switch back to the one active before
+        self.s.cache.invalidate(self.urls["dorf1"], self.urls["dorf2"], "get_info")
+        if current:
+            self.s.get(f"{self.base_url}{self.urls['dorf1']}", params={"newdid": current[0]}, cache=False)
+        snapshot = {
+            "villages": [],
+            "totals": {
+                "stock": {_: 0 for _ in ["warehouse_capacity", "granary_capacity"] + self.mapping["resources_long"]},
+                "production": {_: 0 for _ in self.mapping["resources_short"]},
+                "troops": {}
+            }
+        }
+        for village, info in zip(village_list, infos):
+            snapshot["villages"].append({
+                "id": village["id"],
+                "name": village["name"],
+                "coordinates": village["coordinates"],
+                "info": info
+            })
+            if not info:
+                continue
+            for k in snapshot["totals"]["stock"].keys():
+                snapshot["totals"]["stock"][k] += info["stock"][k]
+            for k in snapshot["totals"]["production"].keys():
+                snapshot["totals"]["production"][k] += info["production"].get(k, 0)
+            for troop in info["troops"]:
+                snapshot["totals"]["troops"][troop["name"]] = snapshot["totals"]["troops"].get(troop["name"], 0) + troop["count"]
+        return snapshot
+
+    @instrumented
     def get_hero_attributes(self):
         logging.debug("Getting hero info.")
-        attributes_page = self.s.get(f"https://{self.server}{self.urls['hero_attributes']}")
-        attributes_soup = BeautifulSoup(attributes_page.text, "html.parser")
+        attributes_page = self.s.get(f"{self.base_url}{self.urls['hero_attributes']}")
         logging.debug("Got hero info page.")
-        hero_attributes = {}
-        hero_attr_raw = json.loads("".join([line for line in attributes_soup.find(text=re.compile(".*screenData.*")).split("\n") if "screenData" in line][0].split(":", 1)[1:]).strip(","))  # too hardcode
-        hero_attributes["attribute_points"] = hero_attr_raw["hero"]["attributePoints"]
-        hero_attributes["attack_behaviour"] = hero_attr_raw["hero"]["attackBehaviour"]
-        hero_attributes["experience"] = hero_attr_raw["hero"]["experience"]
-        hero_attributes["experience_percent"] = hero_attr_raw["hero"]["experiencePercent"]
-        hero_attributes["health"] = round(hero_attr_raw["hero"]["health"], 2)
-        hero_attributes["speed"] = hero_attr_raw["hero"]["speed"]
-        hero_attributes["production"] = [{
-            "name": _,
-            "value": hero_attr_raw["hero"]["productionTypes"][index]
-        } for index, _ in enumerate(self.mapping["resources_overall"])]
-        return hero_attributes
+        return self.parser.parse_hero_attributes(attributes_page.text)
 
+    @instrumented
     def get_hero_inventory(self):
         logging.debug("Getting hero inventory.")
-        inventory_raw = self.s.get(f"https://{self.server}{self.urls['hero_inventory']}", headers={
+        inventory_raw = self.s.get(f"{self.base_url}{self.urls['hero_inventory']}", headers={
             "Authorization": f"Bearer {self.token}"
         }).json()
         if inventory_raw:
@@ -250,67 +1151,110 @@ class Travian(object):
         else:
             logging.error("Failed to get hero inventory JSON.")
             return None
-        inventory = {}
-        inventory["checksum"] = inventory_raw["checksum"]
-        inventory["resources"] = {_: {} for _ in self.mapping["resources_short"]}
-        for resource in inventory["resources"].keys():
-            inventory_resource = [_ for _ in inventory_raw["viewData"]["itemsInventory"] if _["name"] == resource.capitalize()][0]
-            inventory["resources"][resource] = {
-                "village": inventory_resource["alreadyEquipped"],
-                "amount": inventory_resource["amount"],
-                "transfer_id": inventory_resource["id"],
-                "max_transfer": inventory_resource["maxInput"]
-            }
-        return inventory
+        return self.parser.parse_hero_inventory(inventory_raw)
 
+    @instrumented
     def get_tile_info(self, x, y):
         logging.debug(f"Getting tile info of ({x}, {y})")
-        tile_json = self.s.post(f"https://{self.server}{self.urls['tile']}", json={
+        tile_json = self.s.post(f"{self.base_url}{self.urls['tile']}", json={
             "x": x,
             "y": y
         }, headers={
             "Authorization": f"Bearer {self.token}"
-        }).json()
+        }, idempotent=True).json()
         logging.debug("Got tile info JSON.")
-        tile_html = tile_json["html"]
-        soup_tile = BeautifulSoup(tile_html, "html.parser")
-        tile_info = {}
-        if not soup_tile.select("div#map_details"):
-            tile_info["type"] = "wilderness"
+        return self.parse_tile_info(tile_json["html"])
+
+    def parse_tile_info(self, tile_html):
+        return self.parser.parse_tile(tile_html)
+
+    def get_stats(self):
+        stats = self.s.stats.snapshot()
+        stats["throttle"] = self.s.throttle.stats() if self.s.throttle else None
+        return stats
+
+    def scan_tiles(self, coordinates, workers=8):
+        #  the session throttles and retries every request, only the tiles that still fail are left out
+
+        def fetch(x, y):
+            try:
+                return self.get_tile_info(x, y)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logging.error(f"Failed to get tile info of ({x}, {y}): {e}")
+                return None
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {}
+        try:
+            futures = {executor.submit(self.s.stats.bind(fetch), x, y): (x, y) for x, y in coordinates}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def scan_region(self, center, radius, workers=8):
+        coordinates = region_coordinates(center, radius)
+        logging.info(f"Scanning {len(coordinates)} tiles around {coordinates[0]}.")
+        return self.scan_tiles(coordinates, workers=workers)
+
+    @instrumented
+    def estimate_upgrade(self, slot_id, building_id=None, info=None):
+        info = info or self.get_info()
+        if not (1 <= slot_id <= 40):
+            logging.error("slot_id should between 1 and 40.")
+            return False
+        slot = [_ for _ in info["resource_fields" if slot_id < 19 else "buildings"] if _["id"] == slot_id][0]
+        build_id = slot["resource_id" if slot_id < 19 else "building_id"] or building_id
+        if not build_id:
+            logging.warning("Build on an empty slot and building_id is required.")
+            return {
+                "upgrading": False,
+                "message": "the slot is empty, building_id is needed"
+            }
+        level = slot["level"] + 1
+        main_building_level = max([_["level"] for _ in info["buildings"] if _["building_id"] == 15] or [0])
+        demand = build_costs.get_cost(build_id, level)
+        if demand is None:
+            logging.warning(f"No cost known for building_id={build_id} at level {level}.")
+            return {
+                "upgrading": False,
+                "message": "cost unknown"
+            }
+        action_info = {
+            "slot_id": slot_id,
+            "build_id": build_id,
+            "level": level,
+            "demand": demand,
+            "duration": build_costs.format_duration(build_costs.get_duration(build_id, level, main_building_level, self.speed))
+        }
+        if demand["lumber"] > info["stock"]["warehouse_capacity"] or demand["clay"] > info["stock"]["warehouse_capacity"] or demand["iron"] > info["stock"]["warehouse_capacity"]:
+            message = "extend warehouse first"
+        elif demand["crop"] > info["stock"]["granary_capacity"]:
+            message = "extend granary first"
+        elif any(demand[_] > info["stock"][_] for _ in self.mapping["resources_short"]):
+            message = "upgrade not available"
         else:
-            map_details = soup_tile.select("div#map_details")[0]
-            if "oasis" in soup_tile.select("div#tileDetails")[0].get("class"):
-                tile_info["type"] = "oasis"
-                tile_info["distribution"] = [{
-                    "resource": _.select("td.desc")[0].get_text(),
-                    "value": _.select("td.val")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape')
-                } for _ in map_details.select("table#distribution tr") if _.select("td.desc") and _.select("td.val")]
-                tile_info["troops"] = [{
-                    "name": _.select("td.desc")[0].get_text(),
-                    "count": _.select("td.val")[0].get_text().encode('ascii', 'ignore').decode('unicode_escape')
-                } for _ in map_details.select("table#troop_info tr") if _.select("td.desc") and _.select("td.val")]
-            elif "village" in soup_tile.select("div#tileDetails")[0].get("class"):
-                resource_field_types = ["lumber", "clay", "iron", "crop"]
-                if map_details.select("table#village_info"):
-                    tile_info["resource_fields"] = [{
-                        "type": resource_field_types[index],
-                        "count": int(_.get_text())
-                    } for index, _ in enumerate(map_details.select("table#distribution td"))]
-                    village_info = map_details.select("table#village_info")[0]
-                    tile_info["type"] = "village"
-                    tile_info["tribe"] = village_info.select("tr.first td")[0].get_text()
-                    tile_info["owner"] = village_info.select("td.player")[0].get_text()
-                    tile_info["capital"] = True if soup_tile.select("h1 span.mainVillage") else False
-                else:
-                    tile_info["type"] = "abandoned valley"
-                    tile_info["resource_fields"] = [{
-                        "type": resource_field_types[index],
-                        "count": int(_.select("td.val")[0].get_text())
-                    } for index, _ in enumerate(map_details.select("table#distribution tr")) if _.select("td.val")]
-        return tile_info
+            message = "ok"
+        return {
+            "upgrading": message == "ok",
+            "action_info": action_info,
+            "message": message
+        }
+
+    def check_upgrade_cost(self, action_info, level):
+        mismatches = build_costs.compare_cost(action_info["build_id"], level, action_info["demand"])
+        if mismatches:
+            logging.warning(f"Cost of building_id={action_info['build_id']} level {level} differs from the table (table, live): {mismatches}")
+        return not mismatches
 
-    def upgrade(self, slot_id, building_id=None, dryrun=False):
+    @instrumented
+    def upgrade(self, slot_id, building_id=None, dryrun=False, estimate=False):
         logging.debug("Execute upgrading job.")
+        if dryrun and estimate:
+            #  answered from the cost table, without fetching build.php
+            return self.estimate_upgrade(slot_id, building_id)
         info = self.get_info()
         if not (1 <= slot_id <= 40):
             logging.error("slot_id should between 1 and 40.")
@@ -319,37 +1263,35 @@ class Travian(object):
         if slot_id < 19 or build_id:  # resource fields or already built up
             logging.debug(f"slot_id={slot_id}, for resource fields")
             logging.debug("Getting resource field upgrading page.")
-            action_page = self.s.get(f"https://{self.server}{self.urls['build']}", params={
+            action_page = self.s.get(f"{self.base_url}{self.urls['build']}", params={
                 "id": slot_id,
                 "gid": build_id
             })
-            action_soup = BeautifulSoup(action_page.text, "html.parser")
             logging.debug("Got resource field upgrading page.")
-            action_info = {"demand": {}}
-            action_info["slot_id"] = slot_id
-            action_info["build_id"] = build_id
-            action_demand = action_soup.select("div#contract div.resource")
-            action_info["demand"] = {self.mapping["resources_long"][index]: int(_.get_text()) for index, _ in enumerate(action_demand[:len(self.mapping["resources_long"])])}
-            action_info["duration"] = action_soup.select("div.duration")[0].get_text()
-            if action_info["demand"]["lumber"] < info["stock"]["warehouse_capacity"] or action_info["demand"]["clay"] < info["stock"]["warehouse_capacity"] or action_info["demand"]["iron"] < info["stock"]["warehouse_capacity"]:
+            action_info = {"slot_id": slot_id, "build_id": build_id}
+            action_info.update(self.parser.parse_upgrade(self.parser.soup(action_page.text)))
+            action_url = action_info.pop("url")
+            slot_level = [_ for _ in info["resource_fields" if slot_id < 19 else "buildings"] if _["id"] == slot_id][0]["level"]
+            self.check_upgrade_cost(action_info, slot_level + 1)
+            if action_info["demand"]["lumber"] > info["stock"]["warehouse_capacity"] or action_info["demand"]["clay"] > info["stock"]["warehouse_capacity"] or action_info["demand"]["iron"] > info["stock"]["warehouse_capacity"]:
                 logging.warning("Failed to upgrade, warehouse capacity is not enough.")
                 return {
                     "upgrading": False,
                     "action_info": action_info,
                     "message": "extend warehouse first"
                 }
-            if action_info["demand"]["crop"] < info["stock"]["granary_capacity"]:
+            if action_info["demand"]["crop"] > info["stock"]["granary_capacity"]:
                 logging.warning("Failed to upgrade, granary capacity is not enough.")
                 return {
                     "upgrading": False,
                     "action_info": action_info,
                     "message": "extend granary first"
                 }
-            action_button = action_soup.select("div.upgradeButtonsContainer button")[0]
-            if "green" in action_button.get("class"):
-                action_info["url"] = action_button.get("onclick").split("'")[1]
+            if action_url:
+                action_info["url"] = action_url
                 if not dryrun:
-                    self.s.get(f"https://{self.server}{action_info["url"]}")
+                    self.s.get(f"{self.base_url}{action_info['url']}", cache=False, idempotent=False)
+                    self.s.cache.invalidate()
                 logging.info(f"Upgrading slot_id={slot_id} now.")
                 return {
                     "upgrading": True,
@@ -365,19 +1307,13 @@ class Travian(object):
                 }
         else:  # no building at an inner slot
             logging.debug(f"slot_id={slot_id}, for inner buildings")
-            action_pages = [self.s.get(f"https://{self.server}{self.urls['build']}", params={
+            action_pages = [self.s.get(f"{self.base_url}{self.urls['build']}", params={
                 "id": slot_id,
                 "category": i
             }) for i in range(1, 4)]
-            action_soups = [BeautifulSoup(action_page.text, "html.parser") for action_page in action_pages]
+            action_soups = [self.parser.soup(action_page.text) for action_page in action_pages]
             logging.debug("Got inner building upgrading page.")
-            available_buildings = []
-            for index, action_soup in enumerate(action_soups):
-                available_buildings.extend({
-                    "id": int(re.search("\d+", _.select("div.contract")[0].get("id")).group()),
-                    "name": _.select("h2")[0].get_text().lower(),
-                    "category": index + 1
-                } for _ in action_soup.select("div#build div.buildingWrapper") if _.select("button.green"))
+            available_buildings = self.parser.parse_available_buildings(action_soups)
             if not building_id:
                 logging.warning("Build on an empty slot and building_id is required.")
                 return {
@@ -393,17 +1329,13 @@ class Travian(object):
                     "message": "building_id not available"
                 }
             else:
-                action_info = {"demand": {}}
-                action_info["slot_id"] = slot_id
-                action_info["build_id"] = building_id
+                action_info = {"slot_id": slot_id, "build_id": building_id}
                 building_in_category = [_ for _ in available_buildings if _["id"] == building_id][0]["category"]
-                action_demand = action_soups[building_in_category - 1].select(f"div#contract_building{building_id} div.resource")
-                action_info["demand"] = {self.mapping["resources_long"][index]: int(_.get_text()) for index, _ in enumerate(action_demand[:len(self.mapping["resources_long"])])}
-                action_info["duration"] = action_soups[building_in_category - 1].select("div.duration")[0].get_text()
-                action_button = action_soups[building_in_category - 1].select(f"div#contract_building{building_id} button.green")[0]
-                action_info["url"] = action_button.get("onclick").split("'")[1]
+                action_info.update(self.parser.parse_new_building(action_soups[building_in_category - 1], building_id))
+                self.check_upgrade_cost(action_info, 1)
                 if not dryrun:
-                    self.s.get(f"https://{self.server}{action_info["url"]}")
+                    self.s.get(f"{self.base_url}{action_info['url']}", cache=False, idempotent=False)
+                    self.s.cache.invalidate()
                 logging.info(f"Upgrading slot_id={slot_id} now.")
                 return {
                     "upgrading": True,
@@ -411,99 +1343,139 @@ class Travian(object):
                     "message": "ok"
                 }
 
-    def transfer_resources_from_hero(self, resources):
-        for k, v in resources.items():
-            hero_inventory = self.get_hero_inventory()
-            if v <= hero_inventory["resources"][k]["amount"]:
-                if v <= hero_inventory["resources"][k]["max_transfer"]:
-                    self.s.post(f"https://{self.server}{self.urls["hero_click"]}", json={
-                        "action": "inventory",
-                        "checksum": hero_inventory["checksum"],
-                        "id": hero_inventory["resources"][k]["transfer_id"],
-                        "context": "inventory",
-                        "amount": v
-                    }, headers={
-                        "Authorization": f"Bearer {self.token}"
-                    })
-                    transferred = self.get_hero_inventory()
-                    logging.info(f"Transferred {v} {k} from hero's inventory to the village.")
-                    return {
-                        "transferred": True,
-                        "current_resources": {
-                            resource: transferred["resources"][resource]["village"] for resource in transferred["resources"].keys()
-                        },
-                        "message": "ok"
-                    }
-                else:
-                    logging.warning("Failed, no enough space for warehouse or granary.")
-                    return {
-                        "transferred": False,
-                        "message": "no enough space for warehouse or granary"
-                    }
-            else:
-                logging.warning("Failed, no enough resource in hero's inventory.")
-                return {
-                    "transferred": False,
-                    "message": "no enough resource in hero's invetory"
-                }
-                
-    def get_producible_units(self):
+    def hero_click(self, checksum, transfer_id, amount):
+        try:
+            return self.s.post(f"{self.base_url}{self.urls['hero_click']}", json={
+                "action": "inventory",
+                "checksum": checksum,
+                "id": transfer_id,
+                "context": "inventory",
+                "amount": amount
+            }, headers={
+                "Authorization": f"Bearer {self.token}"
+            })
+        except requests.RequestException as e:
+            logging.warning(f"Hero click failed: {e}")
+            return None
+
+    @instrumented
+    def transfer_resources_from_hero(self, resources=None):
+        hero_inventory = self.get_hero_inventory()
+        if not hero_inventory:
+            return {
+                "transferred": False,
+                "message": "failed to get hero's inventory"
+            }
+        amounts, message = hero_transfer_amounts(hero_inventory, self.get_info()["stock"], resources)
+        if message:
+            logging.warning(f"Failed, {message}.")
+            return {
+                "transferred": False,
+                "message": message
+            }
+        checksum = hero_inventory["checksum"]
+        transferred, failed = {}, []
+        for resource, amount in amounts.items():
+            transfer_id = hero_inventory["resources"][resource]["transfer_id"]
+            before = hero_inventory["resources"][resource]["amount"]
+            response = self.hero_click(checksum, transfer_id, amount)
+            done = response is not None and response.ok
+            if not done:
+                #  a stale checksum is refused, but an error may also come after the click was applied
+                self.s.cache.invalidate(self.urls["hero_inventory"])
+                refreshed = self.get_hero_inventory()
+                if refreshed:
+                    checksum = refreshed["checksum"]
+                    if refreshed["resources"][resource]["amount"] != before:
+                        done = True
+                    else:
+                        response = self.hero_click(checksum, transfer_id, amount)
+                        done = response is not None and response.ok
+            if not done:
+                logging.warning(f"Failed to transfer {amount} {resource} from hero's inventory.")
+                failed.append(resource)
+                continue
+            try:
+                checksum = response.json().get("checksum") or checksum
+            except (ValueError, AttributeError):
+                pass
+            transferred[resource] = amount
+            logging.info(f"Transferred {amount} {resource} from hero's inventory to the village.")
+        if transferred:
+            self.s.cache.invalidate(self.urls["hero_inventory"], self.urls["dorf1"], "get_info")
+        current = self.get_hero_inventory() if transferred else hero_inventory
+        return {
+            "transferred": bool(transferred),
+            "amounts": transferred,
+            "failed": failed,
+            "current_resources": {
+                resource: current["resources"][resource]["village"] for resource in current["resources"].keys()
+            } if current else None,
+            "message": "ok" if transferred and not failed else "nothing to transfer" if not amounts else f"failed to transfer {', '.join(failed)}"
+        }
+
+    def get_training_buildings(self, workers=5):
         current_producible_buildings = [_ for _ in self.get_info()["buildings"] if _["building_id"] in self.producible_buildings]
         if not current_producible_buildings:
             logging.warning("No buildings can produce units.")
-            return None
-        producible_units = []
-        for cpb in current_producible_buildings:
+            return []
+
+        def fetch(cpb):
             logging.debug(f"Checking producible units in {cpb['name']}(building_id={cpb['building_id']}).")
-            building_page = self.s.get(f"https://{self.server}{self.urls['build']}", params={
+            building_page = self.s.get(f"{self.base_url}{self.urls['build']}", params={
                 "id": cpb["id"],
                 "gid": cpb["building_id"]
             })
-            building_soup = BeautifulSoup(building_page.text, "html.parser")
-            producible_units.extend([{
-                "demand": {
-                    self.mapping["resources_long"][index]: resource.get_text()
-                for index, resource in enumerate(_.select("div.resource"))},
-                "duration": _.select("div.duration")[0].get_text(),
-                "max_production": int(_.select("a[href='#']")[0].get_text()),
-                "troop_type": _.select("input")[0].get("name"),
-                "troop_name": _.select("img")[0].get("alt"),
-                "building_id": cpb["building_id"]
-            } for _ in building_soup.select("div.trainUnits div.troop div.details")])
-        return producible_units
+            training = self.parser.parse_training(building_page.text, cpb["building_id"])
+            training.update({"slot_id": cpb["id"], "building_id": cpb["building_id"], "name": cpb["name"]})
+            return training
 
-    def produce_units(self, product_plan):
-        current_producible_buildings = [_ for _ in self.get_info()["buildings"] if _["building_id"] in self.producible_buildings]
-        producible_units = self.get_producible_units()
-        produce_result = {
-            "produced": True,
-            "details": []
-        }
-        #  group by building
-        for pb in self.producible_buildings:
-            current_building_slot_id = [_["id"] for _ in current_producible_buildings if _["building_id"] == pb][0]
-            pb_troop_types = {_["troop_type"]: _ for _ in producible_units if _["building_id"] == pb}
-            produce_unit_prefetch_page = self.s.get(f"https://{self.server}{self.urls['build']}", params={
-                "id": current_building_slot_id,
-                "gid": pb
-            })
-            prefetch_soup = BeautifulSoup(produce_unit_prefetch_page.text, "html.parser")
-            produce_unit_payload = {
-                "action": prefetch_soup.select("form[name='snd'] input[name='action']")[0].get("value"),
-                "checksum": prefetch_soup.select("form[name='snd'] input[name='checksum']")[0].get("value"),
-                "s": int(prefetch_soup.select("form[name='snd'] input[name='s']")[0].get("value")),
-                "did": int(prefetch_soup.select("form[name='snd'] input[name='did']")[0].get("value")),
-                "s1": prefetch_soup.select("form[name='snd'] button[name='s1']")[0].get("value")
-            }
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.s.stats.bind(fetch), current_producible_buildings))
+
+    @instrumented
+    def get_producible_units(self):
+        training_buildings = self.get_training_buildings()
+        if not training_buildings:
+            return None
+        return [unit for tb in training_buildings for unit in tb["units"]]
+
+    @instrumented
+    def produce_units(self, product_plan, workers=5):
+        #  the build pages are cached shortly, right after get_producible_units they are not fetched again
+        training_buildings = self.get_training_buildings(workers=workers)
+        jobs = []
+        for tb in training_buildings:
+            if not tb["form"]:
+                logging.warning(f"No training form in {tb['name']}(slot_id={tb['slot_id']}).")
+                continue
+            produce_unit_payload = dict(tb["form"])
             #  troop types in building
-            for ptt in pb_troop_types.keys():
-                produce_unit_payload[ptt] = min(int(product_plan.get(ptt, 0)), pb_troop_types[ptt]["max_production"])
-            self.s.post(f"https://{self.server}{self.urls['build']}", params={
-                "id": current_building_slot_id,
-                "gid": pb
+            for unit in tb["units"]:
+                produce_unit_payload[unit["troop_type"]] = min(int(product_plan.get(unit["troop_type"], 0)), unit["max_production"])
+            if not any(produce_unit_payload.get(unit["troop_type"]) for unit in tb["units"]):
+                continue
+            jobs.append((tb, produce_unit_payload))
+
+        def submit(job):
+            tb, produce_unit_payload = job
+            response = self.s.post(f"{self.base_url}{self.urls['build']}", params={
+                "id": tb["slot_id"],
+                "gid": tb["building_id"]
             }, json=produce_unit_payload)
-            produce_result["details"].append({
-                "building_id": current_building_slot_id,
+            return {
+                "slot_id": tb["slot_id"],
+                "building_id": tb["building_id"],
+                "produced": response.ok,
                 "detail": produce_unit_payload
-            })
-        return produce_result
+            }
+
+        details = []
+        if jobs:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                details = list(executor.map(self.s.stats.bind(submit), jobs))
+            self.s.cache.invalidate(self.urls["build"], self.urls["dorf1"], "get_info")
+        return {
+            "produced": bool(details) and all(_["produced"] for _ in details),
+            "details": details
+        }
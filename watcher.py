@@ -0,0 +1,125 @@
+import logging
+import time
+
+from travian import parse_duration
+
+
+#  movement types of an incoming row that mean troops are coming to fight
+ATTACK_TYPES = ["Attack", "Attacks", "Raid", "Raids"]
+
+
+class Dorf1Watcher(object):
+
+    def __init__(self, travian, sections=("movements", "troops"), min_interval=5, max_interval=120, pending_interval=15, backoff=1.5, tolerance=5, params=None, sleep=time.sleep):
+        self.travian = travian
+        self.sections = list(sections)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        #  longest wait while any movement is on its way
+        self.pending_interval = pending_interval
+        self.backoff = backoff
+        #  seconds an arrival may drift between polls before it counts as another movement
+        self.tolerance = tolerance
+        self.params = params
+        self.sleep = sleep
+        self.interval = min_interval
+        self.digests = {}  # section -> digest of the last raw section
+        self.state = {}  # section -> last parsed section
+        self.polls = 0
+        self.parsed = 0
+
+    def fetch(self):
+        return self.travian.s.get(f"{self.travian.base_url}{self.travian.urls['dorf1']}", params=self.params, cache=False).text
+
+    def parse(self, html, section, raw, now):
+        parser = self.travian.parser
+        if section == "troops":
+            troops = parser.parse_raw_section(raw, section) if raw else parser.parse_section(html, section)
+            return {_["name"]: _["count"] for _ in troops}
+        movements = parser.parse_raw_section(raw, section)
+        #  durations are relative to the page, arrivals stay comparable between polls
+        return {
+            (direction, movement["type"]): {
+                "direction": direction,
+                "type": movement["type"],
+                "count": movement["count"],
+                "arrival": now + parse_duration(movement["duration"])
+            } for direction in ["incoming", "outgoing"] for movement in movements[direction]
+        }
+
+    def diff_movements(self, old, new, now):
+        events = []
+        for key, movement in new.items():
+            previous = old.get(key)
+            if previous and previous["count"] == movement["count"] and abs(previous["arrival"] - movement["arrival"]) <= self.tolerance:
+                #  keep the first seen arrival so the drift does not add up
+                movement["arrival"] = previous["arrival"]
+                continue
+            if previous and movement["count"] < previous["count"]:
+                events.append(dict(movement, event="movement_arrived", previous_count=previous["count"], at=now))
+                continue
+            attack = movement["direction"] == "incoming" and movement["type"] in ATTACK_TYPES
+            events.append(dict(movement, event="incoming_attack" if attack else "new_movement", previous_count=previous["count"] if previous else 0, at=now))
+        for key, movement in old.items():
+            if key not in new:
+                events.append(dict(movement, event="movement_arrived", count=0, previous_count=movement["count"], at=now))
+        return events
+
+    def diff_troops(self, old, new, now):
+        changes = {name: {"previous": old.get(name, 0), "current": new.get(name, 0)} for name in set(old) | set(new) if old.get(name, 0) != new.get(name, 0)}
+        return [{"event": "troops_changed", "changes": changes, "at": now}] if changes else []
+
+    def poll(self):
+        html = self.fetch()
+        now = time.time()
+        self.polls += 1
+        events = []
+        for section in self.sections:
+            raw = self.travian.parser.raw_section(html, section)
+            digest = self.travian.parser.section_digest(raw)
+            if self.digests.get(section) == digest:
+                continue
+            self.digests[section] = digest
+            self.parsed += 1
+            current = self.parse(html, section, raw, now)
+            if section == "movements":
+                #  movements already on their way when watching starts are reported too
+                events.extend(self.diff_movements(self.state.get(section, {}), current, now))
+            elif section in self.state:
+                events.extend(self.diff_troops(self.state[section], current, now))
+            self.state[section] = current
+        self.adapt(events, now)
+        return events
+
+    def pending(self):
+        return list(self.state.get("movements", {}).values())
+
+    def adapt(self, events, now):
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        pending = self.pending()
+        if pending:
+            self.interval = min(self.interval, self.pending_interval)
+            #  poll right after the next arrival instead of somewhere later
+            next_arrival = min(_["arrival"] for _ in pending) - now
+            if next_arrival > 0:
+                self.interval = min(self.interval, next_arrival + 1)
+        self.interval = max(self.interval, self.min_interval)
+
+    def watch(self, polls=None):
+        while polls is None or self.polls < polls:
+            try:
+                events = self.poll()
+            except Exception as e:
+                logging.error(f"Failed to poll dorf1: {e}")
+                events = []
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            for event in events:
+                if event["event"] == "incoming_attack":
+                    logging.warning(f"Incoming {event['type']} x{event['count']} arriving at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['arrival']))}.")
+                yield event
+            if polls is None or self.polls < polls:
+                logging.debug(f"Next dorf1 poll in {self.interval:.0f}s.")
+                self.sleep(self.interval)
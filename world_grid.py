@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+from map_sql import TRIBES
+from travian import MAP_RADIUS
+
+
+TILE_TYPES = ["unknown", "wilderness", "oasis", "abandoned valley", "village"]
+RESOURCES = ["lumber", "clay", "iron", "crop"]
+DIGITS_RE = re.compile(r"\D")
+
+#  column -> (dtype, values per tile)
+COLUMNS = {
+    "type": (np.uint8, 1),
+    "fields": (np.uint8, 4),
+    "bonus": (np.uint8, 4),
+    "animals": (np.uint16, 1),
+    "owner": (np.int32, 1),
+    "tribe": (np.uint8, 1),
+    "last_seen": (np.uint32, 1),
+}
+
+
+class WorldGrid(object):
+
+    def __init__(self, radius=MAP_RADIUS, columns=None, owners=None):
+        self.radius = radius
+        self.size = 2 * radius + 1
+        count = self.size * self.size
+        if columns is None:
+            columns = {name: np.zeros((count, width) if width > 1 else count, dtype=dtype) for name, (dtype, width) in COLUMNS.items()}
+        self.columns = columns
+        #  owner id -> name, ids come from map.sql, owners only known by name get negative ids
+        self.owners = owners or {}
+        self.owner_ids = {name: owner_id for owner_id, name in self.owners.items()}
+        #  x and y of every row, the grid is stored row by row from (-radius, -radius)
+        self.ys, self.xs = [_.ravel() - radius for _ in np.indices((self.size, self.size), dtype=np.int16)]
+
+    def __len__(self):
+        return int((self.columns["type"] != 0).sum())
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns", {})
+        if name in columns:
+            return columns[name]
+        if name in RESOURCES:
+            return columns["fields"][:, RESOURCES.index(name)]
+        if name.startswith("bonus_") and name[len("bonus_"):] in RESOURCES:
+            return columns["bonus"][:, RESOURCES.index(name[len("bonus_"):])]
+        raise AttributeError(name)
+
+    def index(self, x, y):
+        return (np.asarray(y) + self.radius) * self.size + (np.asarray(x) + self.radius)
+
+    def owner_id(self, name, player_id=None):
+        if name is None:
+            return 0
+        if player_id:
+            previous = self.owner_ids.get(name)
+            if previous is not None and previous < 0:
+                #  the name was seen on a tile before map.sql told its id
+                self.columns["owner"][self.columns["owner"] == previous] = player_id
+                del self.owners[previous]
+            self.owners[player_id] = name
+            self.owner_ids[name] = player_id
+            return player_id
+        if name not in self.owner_ids:
+            owner_id = min([0] + list(self.owners.keys())) - 1
+            self.owners[owner_id] = name
+            self.owner_ids[name] = owner_id
+        return self.owner_ids[name]
+
+    def tribe_id(self, tribe):
+        if isinstance(tribe, int):
+            return tribe
+        return next((tribe_id for tribe_id, name in TRIBES.items() if name == tribe), 0)
+
+    def set_tile(self, x, y, tile_info, last_seen=None):
+        i = self.index(x, y)
+        columns = self.columns
+        columns["type"][i] = TILE_TYPES.index(tile_info["type"]) if tile_info["type"] in TILE_TYPES else 0
+        columns["fields"][i] = [next((_["count"] for _ in tile_info.get("resource_fields", []) if _["type"] == resource), 0) for resource in RESOURCES]
+        columns["bonus"][i] = 0
+        columns["animals"][i] = 0
+        if tile_info["type"] == "oasis":
+            #  the tile page holds strings such as "25%"
+            for bonus in tile_info.get("distribution", []):
+                if bonus["resource"].lower() in RESOURCES:
+                    columns["bonus"][i, RESOURCES.index(bonus["resource"].lower())] = int(DIGITS_RE.sub("", str(bonus["value"])) or 0)
+            columns["animals"][i] = min(sum(int(_["count"]) for _ in tile_info.get("troops", [])), np.iinfo(np.uint16).max)
+        columns["owner"][i] = self.owner_id(tile_info.get("owner"), tile_info.get("player_id")) if tile_info["type"] == "village" else 0
+        columns["tribe"][i] = self.tribe_id(tile_info.get("tribe")) if tile_info["type"] == "village" else 0
+        columns["last_seen"][i] = int(last_seen or time.time())
+
+    def update_villages(self, villages, last_seen=None):
+        #  rows of parse_map_sql, the resource fields of tiles already known are kept
+        last_seen = int(last_seen or time.time())
+        count = 0
+        for village in villages:
+            i = self.index(village["x"], village["y"])
+            self.columns["type"][i] = TILE_TYPES.index("village")
+            self.columns["owner"][i] = self.owner_id(village.get("owner"), village.get("player_id"))
+            self.columns["tribe"][i] = self.tribe_id(village.get("tribe"))
+            self.columns["last_seen"][i] = last_seen
+            count += 1
+        return count
+
+    def load_tile_index(self, tile_index):
+        count = 0
+        for row in tile_index.db.execute("SELECT * FROM tiles"):
+            tile_info = tile_index._tile(row)
+            tile_info["player_id"] = row["player_id"]
+            self.set_tile(row["x"], row["y"], tile_info, last_seen=row["last_seen"])
+            count += 1
+        return count
+
+    def get(self, x, y):
+        i = int(self.index(x, y))
+        if not self.columns["type"][i]:
+            return None
+        return self.tile(i)
+
+    def tile(self, i):
+        columns = self.columns
+        tile_type = TILE_TYPES[columns["type"][i]]
+        tile_info = {"x": int(self.xs[i]), "y": int(self.ys[i]), "type": tile_type, "last_seen": int(columns["last_seen"][i])}
+        if tile_type in ["village", "abandoned valley"] and columns["fields"][i].any():
+            tile_info["resource_fields"] = [{"type": resource, "count": int(columns["fields"][i, index])} for index, resource in enumerate(RESOURCES)]
+        if tile_type == "oasis":
+            tile_info["bonus"] = {resource: int(columns["bonus"][i, index]) for index, resource in enumerate(RESOURCES) if columns["bonus"][i, index]}
+            tile_info["animals"] = int(columns["animals"][i])
+        if tile_type == "village":
+            tile_info["owner_id"] = int(columns["owner"][i])
+            tile_info["owner"] = self.owners.get(tile_info["owner_id"])
+            tile_info["tribe"] = TRIBES.get(int(columns["tribe"][i]))
+        return tile_info
+
+    def distances(self, center):
+        if isinstance(center, dict):
+            center = (center["x"], center["y"])
+        #  the map wraps around, the other way round may be shorter
+        dx = np.abs(self.xs - center[0]) % self.size
+        dy = np.abs(self.ys - center[1]) % self.size
+        dx = np.minimum(dx, self.size - dx).astype(np.float32)
+        dy = np.minimum(dy, self.size - dy).astype(np.float32)
+        return np.sqrt(dx * dx + dy * dy)
+
+    def column(self, name):
+        return getattr(self, name)
+
+    def mask(self, **conditions):
+        #  same conditions as TileIndex.query, a _min or _max suffix compares instead of matching
+        mask = self.columns["type"] != 0
+        for name, value in conditions.items():
+            if name.endswith("_min") or name.endswith("_max"):
+                column = self.column(name[:-4])
+                mask &= column >= value if name.endswith("_min") else column <= value
+                continue
+            if name == "type":
+                value = [TILE_TYPES.index(_) for _ in (value if isinstance(value, (list, tuple)) else [value])]
+            elif name == "tribe":
+                value = [self.tribe_id(_) for _ in (value if isinstance(value, (list, tuple)) else [value])]
+            elif name == "owner":
+                #  a name never seen matches no tile, 0 would match every tile without a village
+                value = [self.owner_ids[_] if isinstance(_, str) else _ for _ in (value if isinstance(value, (list, tuple)) else [value]) if not isinstance(_, str) or _ in self.owner_ids]
+            column = self.column(name)
+            mask &= np.isin(column, value) if isinstance(value, (list, tuple)) else column == value
+        return mask
+
+    def top(self, k, key, mask=None, largest=True):
+        values = self.column(key) if isinstance(key, str) else key
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(values))
+        scores = values[candidates].astype(np.float64)
+        if not largest:
+            scores = -scores
+        if k < len(candidates):
+            #  only the k best are sorted
+            best = np.argpartition(-scores, k)[:k]
+            candidates, scores = candidates[best], scores[best]
+        return candidates[np.argsort(-scores, kind="stable")]
+
+    def query(self, center=None, radius=None, limit=None, **conditions):
+        mask = self.mask(**conditions)
+        distances = None
+        if center is not None:
+            distances = self.distances(center)
+            if radius is not None:
+                mask &= distances <= radius
+            indices = self.top(limit or int(mask.sum()), distances, mask=mask, largest=False)
+        else:
+            indices = np.flatnonzero(mask)[:limit]
+        tiles = []
+        for i in indices:
+            tile_info = self.tile(i)
+            if distances is not None:
+                tile_info["distance"] = round(float(distances[i]), 2)
+            tiles.append(tile_info)
+        return tiles
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"radius": self.radius, "owners": self.owners}, f)
+        logging.info(f"Saved {len(self)} tiles to {path}.")
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        #  columns stay on disk and are paged in when touched, "r+" writes changes back, None reads into memory
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in COLUMNS.keys()}
+        return cls(radius=meta["radius"], columns=columns, owners={int(k): v for k, v in meta["owners"].items()})